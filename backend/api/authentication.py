@@ -0,0 +1,68 @@
+import threading
+
+from django.conf import settings
+from django.core.cache import caches
+from django.dispatch import Signal
+from rest_framework import exceptions
+from rest_framework.authentication import TokenAuthentication
+
+cache = caches[settings.API_CACHE_ALIAS]
+
+# Отправляется при каждой проверке токена с аргументом hit=True/False.
+token_cache_lookup = Signal()
+
+
+def token_cache_key(key):
+    return f'api:token:{key}'
+
+
+class TokenCacheStats:
+    """Счётчики попаданий в кэш токенов в текущем процессе."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def record(self, hit):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    @property
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+
+token_cache_stats = TokenCacheStats()
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """
+    TokenAuthentication, который хранит найденный токен вместе с
+    пользователем в кэше API_CACHE_ALIAS на TOKEN_CACHE_TTL секунд.
+    Записи удаляются сигналами при удалении токена (выход через djoser)
+    и при изменении пользователя.
+    """
+
+    def authenticate_credentials(self, key):
+        token = cache.get(token_cache_key(key))
+        hit = token is not None
+        token_cache_stats.record(hit)
+        token_cache_lookup.send(sender=self.__class__, hit=hit)
+
+        if not hit:
+            model = self.get_model()
+            try:
+                token = model.objects.select_related('user').get(key=key)
+            except model.DoesNotExist:
+                raise exceptions.AuthenticationFailed('Invalid token.')
+            cache.set(token_cache_key(key), token, settings.TOKEN_CACHE_TTL)
+
+        if not token.user.is_active:
+            raise exceptions.AuthenticationFailed('User inactive or deleted.')
+
+        return token.user, token
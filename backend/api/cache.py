@@ -0,0 +1,82 @@
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.http import HttpResponse, HttpResponseNotModified
+from django.utils.cache import patch_cache_control
+from django.utils.http import parse_etags
+from rest_framework.renderers import JSONRenderer
+
+cache = caches[settings.API_CACHE_ALIAS]
+
+
+def version_key(group):
+    return f'api:version:{group}'
+
+
+def get_version(group):
+    """
+    Текущая версия группы ответов. Если ключ версии потерян, берётся
+    новое уникальное значение, чтобы старые записи уже не совпали.
+    """
+    version = cache.get(version_key(group))
+    if version is None:
+        cache.add(version_key(group), time.time_ns(), timeout=None)
+        return cache.get(version_key(group), time.time_ns())
+    return version
+
+
+def bump_version(group):
+    try:
+        cache.incr(version_key(group))
+    except ValueError:
+        cache.delete(version_key(group))
+        get_version(group)
+
+
+class VersionedCacheMixin:
+    """
+    Кэширует готовые байты ответов list и retrieve для справочных данных.
+    Ключ включает версию группы cache_group, которую сигналы увеличивают
+    при изменении модели, поэтому явно удалять записи не нужно.
+    """
+
+    cache_group = None
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(request, super().list, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached_response(
+            request, super().retrieve, *args, **kwargs
+        )
+
+    def cached_response(self, request, view, *args, **kwargs):
+        key = 'api:response:{}:{}:{}'.format(
+            self.cache_group,
+            get_version(self.cache_group),
+            request.get_full_path()
+        )
+        entry = cache.get(key)
+        if entry is None:
+            response = view(request, *args, **kwargs)
+            if response.status_code != 200:
+                return response
+            content = JSONRenderer().render(response.data)
+            entry = (content, '"{}"'.format(hashlib.md5(content).hexdigest()))
+            cache.set(key, entry)
+
+        content, etag = entry
+        if_none_match = parse_etags(request.META.get('HTTP_IF_NONE_MATCH', ''))
+        if etag in if_none_match or '*' in if_none_match:
+            response = HttpResponseNotModified()
+        else:
+            response = HttpResponse(content, content_type='application/json')
+        response['ETag'] = etag
+        patch_cache_control(
+            response,
+            public=True,
+            max_age=settings.API_CACHE_MAX_AGE
+        )
+        return response
@@ -2,13 +2,68 @@
 
 import base64
 import binascii
-import imghdr
 import io
+import os
+import re
+import threading
 import uuid
+from collections import OrderedDict
 
+from django.conf import settings
 from django.core.exceptions import ValidationError
-from django.core.files.uploadedfile import SimpleUploadedFile
-from rest_framework.fields import ImageField
+from django.core.files.uploadedfile import (InMemoryUploadedFile,
+                                            TemporaryUploadedFile)
+from rest_framework.fields import ImageField, ReadOnlyField
+
+from recipes.images import VARIANT_FORMATS, variant_name, variant_widths
+from recipes.models import Recipe
+
+BASE64_MARKER = ';base64,'
+# Кратно 4, чтобы каждый кусок декодировался независимо.
+DECODE_CHUNK_SIZE = 64 * 1024
+HEADER_SIZE = 16
+WHITESPACE_RE = re.compile(r'\s+')
+DEFAULT_MAX_SIZE = 10 * 1024 * 1024
+DEFAULT_MAX_INLINE_SIZE = 256 * 1024
+INLINE_CACHE_SIZE = 32 * 1024 * 1024
+
+
+class EncodedFileCache:
+    """
+    LRU-кэш base64-представлений файлов с ограничением на общий объём.
+    Ключ включает путь, время изменения и размер файла, поэтому
+    изменённый файл просто получает новую запись.
+    """
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.size = 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._items.get(key)
+            if value is not None:
+                self._items.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        if len(value) > self.max_size:
+            return
+
+        with self._lock:
+            old = self._items.pop(key, None)
+            if old is not None:
+                self.size -= len(old)
+            self._items[key] = value
+            self.size += len(value)
+            while self.size > self.max_size:
+                _, evicted = self._items.popitem(last=False)
+                self.size -= len(evicted)
+
+
+encoded_files = EncodedFileCache(INLINE_CACHE_SIZE)
 
 
 class Base64FieldMixin:
@@ -26,12 +81,21 @@ class Base64FieldMixin:
     def invalid_type_message(self):
         raise NotImplementedError
 
+    @property
+    def file_too_large_message(self):
+        return f'File is too large. Maximum size is {self.max_size} bytes.'
+
     def __init__(self, *args, **kwargs):
         self.trust_provided_content_type = kwargs.pop(
             'trust_provided_content_type',
             False
         )
         self.represent_in_base64 = kwargs.pop('represent_in_base64', False)
+        self.max_inline_size = kwargs.pop(
+            'max_inline_size',
+            DEFAULT_MAX_INLINE_SIZE
+        )
+        self.max_size = kwargs.pop('max_size', DEFAULT_MAX_SIZE)
         super().__init__(*args, **kwargs)
 
     def to_internal_value(self, base64_data):
@@ -39,61 +103,108 @@ class Base64FieldMixin:
         if base64_data in self.EMPTY_VALUES:
             return None
 
-        if isinstance(base64_data, str):
-            file_mime_type = None
+        if not isinstance(base64_data, str):
+            raise ValidationError(
+                'Invalid type. This is not an base64 string: '
+                f'{type(base64_data)}'
+            )
 
-            # Strip base64 header, get mime_type from base64 header.
-            if ';base64,' in base64_data:
-                header, base64_data = base64_data.split(';base64,')
-                if self.trust_provided_content_type:
-                    file_mime_type = header.replace('data:', '')
+        # Find the payload after the base64 header without copying it,
+        # get mime_type from the header.
+        file_mime_type = None
+        start = base64_data.find(BASE64_MARKER)
+        if start == -1:
+            start = 0
+        else:
+            if self.trust_provided_content_type:
+                file_mime_type = base64_data[:start].replace('data:', '')
+            start += len(BASE64_MARKER)
 
-            # Try to decode the file. Return validation error if it fails.
-            try:
-                decoded_file = base64.b64decode(base64_data)
-            except (TypeError, binascii.Error, ValueError):
-                raise ValidationError(self.invalid_file_message)
+        # Line-wrapped base64 (MIME, base64 utility) is copied without
+        # whitespace, otherwise chunks would not be aligned to 4 chars.
+        if WHITESPACE_RE.search(base64_data, start):
+            base64_data = WHITESPACE_RE.sub('', base64_data[start:])
+            start = 0
+
+        # Reject oversized files before decoding anything.
+        size = (len(base64_data) - start) * 3 // 4
+        if size > self.max_size:
+            raise ValidationError(self.file_too_large_message)
 
-            # Generate file name:
-            file_name = self.get_file_name(decoded_file)
+        data = self.decode_to_file(base64_data, start, size, file_mime_type)
 
-            # Get the file name extension:
-            file_extension = self.get_file_extension(file_name, decoded_file)
+        data.seek(0)
+        file_extension = self.get_file_extension(
+            data.name, data.read(HEADER_SIZE)
+        )
+        if file_extension not in self.allowed_types:
+            data.close()
+            raise ValidationError(self.invalid_type_message)
 
-            if file_extension not in self.allowed_types:
-                raise ValidationError(self.invalid_type_message)
+        data.name = self.get_file_name(data) + '.' + file_extension
+        data.seek(0)
 
-            complete_file_name = file_name + '.' + file_extension
-            data = SimpleUploadedFile(
-                name=complete_file_name,
-                content=decoded_file,
-                content_type=file_mime_type
+        return super().to_internal_value(data)
+
+    def decode_to_file(self, base64_data, start, size, content_type):
+        """
+        Декодирует base64 по частям во временный файл: небольшие файлы
+        остаются в памяти, большие пишутся на диск, как при обычной
+        загрузке файлов в Django.
+        """
+        if size > settings.FILE_UPLOAD_MAX_MEMORY_SIZE:
+            data = TemporaryUploadedFile('upload', content_type, size, None)
+        else:
+            data = InMemoryUploadedFile(
+                io.BytesIO(), None, 'upload', content_type, size, None
             )
 
-            return super().to_internal_value(data)
+        try:
+            for position in range(start, len(base64_data), DECODE_CHUNK_SIZE):
+                data.write(base64.b64decode(
+                    base64_data[position:position + DECODE_CHUNK_SIZE],
+                    validate=True
+                ))
+        except (TypeError, binascii.Error, ValueError):
+            data.close()
+            raise ValidationError(self.invalid_file_message)
 
-        raise ValidationError(
-            f'Invalid type. This is not an base64 string: {type(base64_data)}'
-        )
+        data.size = data.tell()
+        return data
 
-    def get_file_extension(self, filename, decoded_file):
+    def get_file_extension(self, filename, header):
         raise NotImplementedError
 
     def get_file_name(self, decoded_file):
         return str(uuid.uuid4())
 
     def to_representation(self, file):
-        if self.represent_in_base64:
-            if not file:
-                return ""
+        if not self.represent_in_base64:
+            return super().to_representation(file)
+
+        if not file:
+            return ""
+
+        try:
+            stat = os.stat(file.path)
+        except Exception:
+            raise OSError("Error encoding file")
 
+        # Large files are returned as a URL instead of blocking the worker.
+        if stat.st_size > self.max_inline_size:
+            return super().to_representation(file)
+
+        key = (file.path, stat.st_mtime_ns, stat.st_size)
+        encoded = encoded_files.get(key)
+        if encoded is None:
             try:
                 with open(file.path, "rb") as f:
-                    return base64.b64encode(f.read()).decode()
+                    encoded = base64.b64encode(f.read()).decode()
             except Exception:
                 raise OSError("Error encoding file")
-        else:
-            return super().to_representation(file)
+            encoded_files.set(key, encoded)
+
+        return encoded
 
 
 class Base64ImageField(Base64FieldMixin, ImageField):
@@ -109,21 +220,47 @@ class Base64ImageField(Base64FieldMixin, ImageField):
     invalid_file_message = 'Please upload a valid image.'
     invalid_type_message = 'The type of the image couldn\'t be determined.'
 
-    def get_file_extension(self, filename, decoded_file):
-        try:
-            from PIL import Image
-        except ImportError:
-            raise ImportError('Pillow is not installed.')
-        extension = imghdr.what(filename, decoded_file)
-
-        # Try with PIL as fallback if format not detected due
-        # to bug in imghdr https://bugs.python.org/issue16512
-        if extension is None:
-            try:
-                image = Image.open(io.BytesIO(decoded_file))
-            except OSError:
-                raise ValidationError(self.invalid_file_message)
+    signatures = (
+        (b'\xff\xd8\xff', 'jpg'),
+        (b'\x89PNG\r\n\x1a\n', 'png'),
+        (b'GIF87a', 'gif'),
+        (b'GIF89a', 'gif'),
+    )
+
+    def get_file_extension(self, filename, header):
+        for signature, extension in self.signatures:
+            if header.startswith(signature):
+                return extension
+
+        raise ValidationError(self.invalid_file_message)
+
+
+class ImageSrcsetField(ReadOnlyField):
+    """
+    Уменьшенные копии изображения рецепта: для каждого формата строка
+    в формате атрибута srcset. Пока копии не созданы, возвращает {}.
+    """
+
+    def __init__(self, **kwargs):
+        kwargs.setdefault('source', '*')
+        super().__init__(**kwargs)
+
+    def to_representation(self, recipe):
+        digest = recipe.image_hash
+        if not digest:
+            return {}
 
-            extension = image.format.lower()
+        storage = Recipe._meta.get_field('image').storage
+        request = self.context.get('request')
+        widths = variant_widths(recipe.image_width)
+        srcset = {}
+        for extension in VARIANT_FORMATS:
+            urls = []
+            for width in widths:
+                url = storage.url(variant_name(digest, width, extension))
+                if request is not None:
+                    url = request.build_absolute_uri(url)
+                urls.append(f'{url} {width}w')
+            srcset[extension] = ', '.join(urls)
 
-        return 'jpg' if extension == 'jpeg' else extension
+        return srcset
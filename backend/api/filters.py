@@ -1,18 +1,14 @@
 from django.contrib.auth import get_user_model
-from django_filters.rest_framework import (BooleanFilter, FilterSet,
-                                           ModelChoiceFilter,
+from django.db.models import Exists, OuterRef
+from django_filters.rest_framework import (BooleanFilter, CharFilter,
+                                           FilterSet, ModelChoiceFilter,
                                            ModelMultipleChoiceFilter)
-from rest_framework.filters import SearchFilter
 
-from recipes.models import Recipe, Tag
+from recipes.models import Recipe, RecipeTag, Tag
 
 User = get_user_model()
 
 
-class IngredientFilter(SearchFilter):
-    search_param = 'name'
-
-
 class RecipeFilter(FilterSet):
     author = ModelChoiceFilter(
         queryset=User.objects.all(),
@@ -23,6 +19,7 @@ class RecipeFilter(FilterSet):
         queryset=Tag.objects.all(),
         field_name='tags__slug',
         to_field_name='slug',
+        method='filter_tags',
         label='Теги'
     )
     is_in_shopping_cart = BooleanFilter(
@@ -35,6 +32,10 @@ class RecipeFilter(FilterSet):
         method='filter_is_favorited',
         label='В избранном'
     )
+    search = CharFilter(
+        method='filter_search',
+        label='Поиск'
+    )
 
     class Meta:
         model = Recipe
@@ -43,8 +44,28 @@ class RecipeFilter(FilterSet):
             'tags',
             'is_in_shopping_cart',
             'is_favorited',
+            'search',
         )
 
+    def filter_tags(self, queryset, name, value):
+        if not value:
+            return queryset
+
+        return queryset.annotate(
+            has_tags=Exists(
+                RecipeTag.objects.filter(
+                    recipe=OuterRef('pk'),
+                    tag__in=value
+                )
+            )
+        ).filter(has_tags=True)
+
+    def filter_search(self, queryset, name, value):
+        if not value.strip():
+            return queryset
+
+        return queryset.search(value)
+
     def filter_is_in_shopping_cart(self, queryset, name, value):
         user = self.request.user
         if not user or user.is_anonymous:
@@ -0,0 +1,80 @@
+import threading
+import time
+from bisect import bisect_left
+
+from recipes.models import Ingredient
+
+SEARCH_LIMIT = 50
+INDEX_TTL = 300
+
+
+class IngredientIndex:
+    """
+    Отсортированный по названию индекс ингредиентов в памяти процесса.
+
+    Поиск по началу названия выполняется бинарным поиском, совпадения
+    по подстроке добавляются после них. Индекс строится при первом
+    обращении, сбрасывается сигналами модели Ingredient и перестраивается
+    не реже раза в INDEX_TTL секунд, чтобы изменения из других процессов
+    тоже доходили до него.
+    """
+
+    def __init__(self, ttl=INDEX_TTL):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._keys = None
+        self._items = None
+        self._built_at = 0
+
+    def invalidate(self):
+        with self._lock:
+            self._keys = None
+            self._items = None
+
+    def _build(self):
+        rows = sorted(
+            Ingredient.objects.values('id', 'name', 'measurement_unit'),
+            key=lambda row: (
+                row['name'].casefold(),
+                row['measurement_unit'].casefold()
+            )
+        )
+        return [row['name'].casefold() for row in rows], rows
+
+    def _get(self):
+        keys, items = self._keys, self._items
+        if keys is not None and time.monotonic() - self._built_at < self.ttl:
+            return keys, items
+
+        with self._lock:
+            if (self._keys is None
+                    or time.monotonic() - self._built_at >= self.ttl):
+                self._keys, self._items = self._build()
+                self._built_at = time.monotonic()
+            return self._keys, self._items
+
+    def all(self):
+        return self._get()[1]
+
+    def search(self, query, limit=SEARCH_LIMIT):
+        keys, items = self._get()
+        query = query.casefold()
+
+        start = bisect_left(keys, query)
+        end = start
+        while end < len(keys) and keys[end].startswith(query):
+            end += 1
+        result = items[start:min(end, start + limit)]
+
+        if len(result) < limit:
+            for position, key in enumerate(keys):
+                if start <= position < end or query not in key:
+                    continue
+                result.append(items[position])
+                if len(result) == limit:
+                    break
+
+        return result
+
+
+ingredient_index = IngredientIndex()
@@ -0,0 +1,45 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from recipes.models import Tag
+
+from ...plans import explain_feed
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    """
+    Команда для ручной проверки планов запросов ленты на рабочей базе.
+    Те же проверки выполняет тест api.tests.FeedPlanTest.
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--verbose-plans',
+            action='store_true',
+            help='Выводить планы запросов целиком'
+        )
+
+    def handle(self, *args, **options):
+        user = User.objects.order_by('pk').first()
+        tag = Tag.objects.order_by('pk').first()
+        if user is None or tag is None:
+            raise CommandError('Нужны хотя бы один пользователь и один тег')
+
+        failed = []
+        for title, plan, indexes, used in explain_feed(user, tag):
+            if used:
+                self.stdout.write(self.style.SUCCESS(
+                    f'{title}: {", ".join(used)}'
+                ))
+            else:
+                failed.append(title)
+                self.stdout.write(self.style.ERROR(
+                    f'{title}: не используется {", ".join(indexes)}'
+                ))
+            if options['verbose_plans']:
+                self.stdout.write(plan)
+
+        if failed:
+            raise CommandError(f'Индексы не используются: {", ".join(failed)}')
@@ -1,5 +1,141 @@
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from collections import OrderedDict
+from datetime import datetime
+
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
 from rest_framework.pagination import PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
 
 
 class PageLimitPagination(PageNumberPagination):
     page_size_query_param = 'limit'
+
+
+class RecipePagination(PageLimitPagination):
+    """
+    Постраничный вывод рецептов. По умолчанию работает как
+    PageLimitPagination, а с параметром cursor переходит на keyset-режим:
+    следующая страница выбирается условием по (pub_date, id) через индекс,
+    без OFFSET и без подсчёта общего количества.
+    """
+
+    cursor_query_param = 'cursor'
+    invalid_cursor_message = 'Неверный курсор'
+
+    def uses_cursor(self, request):
+        return self.cursor_query_param in request.query_params
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.use_cursor = self.uses_cursor(request)
+        if not self.use_cursor:
+            return super().paginate_queryset(queryset, request, view)
+
+        self.request = request
+        page_size = self.get_page_size(request)
+        page = self.keyset_page(
+            queryset, self.decode_cursor(request), page_size + 1
+        )
+        return self.cut_page(page, page_size)
+
+    def keyset_page(self, queryset, position, limit, date_field='pub_date',
+                    **conditions):
+        """
+        До limit объектов после position в порядке (date_field, id) по
+        убыванию. Условия conditions и курсор применяются одним filter(),
+        чтобы связь из date_field присоединялась один раз.
+        """
+        condition = Q(**conditions)
+        if position is not None:
+            pub_date, pk = position
+            condition &= (
+                Q(**{f'{date_field}__lt': pub_date})
+                | Q(**{date_field: pub_date, 'pk__lt': pk})
+            )
+
+        return list(
+            queryset.filter(condition).order_by(f'-{date_field}', '-id')[
+                :limit
+            ]
+        )
+
+    def cut_page(self, page, page_size):
+        self.next_position = None
+        if len(page) > page_size:
+            page = page[:page_size]
+            self.next_position = (page[-1].pub_date, page[-1].pk)
+
+        return page
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+
+        try:
+            decoded = urlsafe_b64decode(encoded.encode()).decode()
+            pub_date, pk = decoded.rsplit('|', 1)
+            return datetime.fromisoformat(pub_date), int(pk)
+        except (TypeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def encode_cursor(self, position):
+        pub_date, pk = position
+        return urlsafe_b64encode(
+            f'{pub_date.isoformat()}|{pk}'.encode()
+        ).decode()
+
+    def get_next_link(self):
+        if not self.use_cursor:
+            return super().get_next_link()
+
+        if self.next_position is None:
+            return None
+
+        return replace_query_param(
+            self.request.build_absolute_uri(),
+            self.cursor_query_param,
+            self.encode_cursor(self.next_position)
+        )
+
+    def get_paginated_response(self, data):
+        if not self.use_cursor:
+            return super().get_paginated_response(data)
+
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('results', data)
+        ]))
+
+
+class FeedPagination(RecipePagination):
+    """
+    Лента подписок всегда листается курсором. Для собранной ленты
+    сначала читаются записи FeedEntry по индексу (user, pub_date), а
+    после них — рецепты старше начала ленты обычным запросом.
+    """
+
+    def uses_cursor(self, request):
+        return True
+
+    def paginate_feed(self, queryset, user, since, older, request):
+        self.use_cursor = True
+        self.request = request
+        page_size = self.get_page_size(request)
+        position = self.decode_cursor(request)
+
+        page = []
+        if position is None or position[0] >= since:
+            page = self.keyset_page(
+                queryset, position, page_size + 1,
+                date_field='feed_entries__pub_date',
+                feed_entries__user=user
+            )
+            position = None
+        if len(page) <= page_size:
+            page += self.keyset_page(
+                older, position, page_size + 1 - len(page)
+            )
+
+        return self.cut_page(page, page_size)
@@ -0,0 +1,209 @@
+import heapq
+import logging
+import threading
+import time
+from array import array
+from bisect import bisect_left
+from collections import Counter
+
+from django.db import close_old_connections
+
+from recipes.models import RecipeIngredient
+
+SEARCH_LIMIT = 100
+INDEX_TTL = 300
+
+logger = logging.getLogger(__name__)
+
+
+class PantryIndex:
+    """
+    Обратный индекс «ингредиент → рецепты» в памяти процесса.
+
+    Для каждого признака рецепта (здесь — ингредиента) хранится
+    отсортированный array('I') с id рецептов, для каждого рецепта — число
+    его признаков. Поиск складывает списки выбранных ингредиентов в
+    Counter (подсчёт идёт в C, без цикла Python по рецептам) и получает
+    для каждого рецепта число имеющихся ингредиентов. Изменения рецептов
+    применяются к индексу после коммита, а полная перестройка из базы
+    идёт не реже раза в INDEX_TTL секунд в фоновом потоке: запросы до её
+    окончания обслуживает прежний индекс. Ждать приходится только первой
+    сборки.
+    """
+
+    def __init__(self, ttl=INDEX_TTL):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._rebuild_lock = threading.Lock()
+        self._postings = None
+        self._sizes = None
+        self._pending = None
+        self._built_at = 0
+
+    def invalidate(self):
+        with self._lock:
+            self._postings = None
+            self._sizes = None
+
+    def is_stale(self):
+        return (self._postings is None
+                or time.monotonic() - self._built_at >= self.ttl)
+
+    def get_features(self):
+        """Пары (признак, id рецепта) по возрастанию id рецепта."""
+        return RecipeIngredient.objects.order_by(
+            'recipe_id'
+        ).values_list('ingredient_id', 'recipe_id').iterator()
+
+    def _build(self):
+        postings = {}
+        sizes = Counter()
+        for feature, recipe_id in self.get_features():
+            if feature not in postings:
+                postings[feature] = array('I')
+            postings[feature].append(recipe_id)
+            sizes[recipe_id] += 1
+        return postings, dict(sizes)
+
+    def _swap(self):
+        """
+        Собирает индекс заново и подменяет им текущий. Изменения,
+        пришедшие во время сборки, повторяются на новом индексе: сборка
+        могла прочитать данные до их коммита.
+        """
+        with self._lock:
+            self._pending = []
+        try:
+            postings, sizes = self._build()
+        except Exception:
+            with self._lock:
+                self._pending = None
+            raise
+
+        with self._lock:
+            for change in self._pending:
+                self._apply(postings, sizes, *change)
+            self._pending = None
+            self._postings, self._sizes = postings, sizes
+            self._built_at = time.monotonic()
+
+    def rebuild(self):
+        """Перестраивает устаревший индекс и ждёт окончания сборки."""
+        with self._rebuild_lock:
+            if self.is_stale():
+                self._swap()
+
+    def _rebuild_in_background(self):
+        close_old_connections()
+        try:
+            self._swap()
+        except Exception:
+            logger.exception('Ошибка перестройки %s', type(self).__name__)
+        finally:
+            self._rebuild_lock.release()
+            close_old_connections()
+
+    def _get(self):
+        postings, sizes = self._postings, self._sizes
+        if postings is None:
+            self.rebuild()
+            return self._postings, self._sizes
+
+        if self.is_stale() and self._rebuild_lock.acquire(blocking=False):
+            threading.Thread(
+                target=self._rebuild_in_background,
+                name=f'{type(self).__name__}-rebuild',
+                daemon=True
+            ).start()
+        return postings, sizes
+
+    @staticmethod
+    def _apply(postings, sizes, recipe_id, added, removed):
+        """
+        Применяет изменение рецепта к postings и sizes. Уже учтённые
+        признаки пропускаются, поэтому изменение можно применить
+        повторно. Пустой added и removed=None исключают рецепт из выдачи.
+        """
+        if removed is None:
+            sizes.pop(recipe_id, None)
+            return
+
+        size = sizes.get(recipe_id, 0)
+        for feature in removed:
+            posting = postings.get(feature)
+            if posting is None:
+                continue
+            position = bisect_left(posting, recipe_id)
+            if position < len(posting) and posting[position] == recipe_id:
+                posting = array('I', posting)
+                del posting[position]
+                postings[feature] = posting
+                size -= 1
+
+        for feature in added:
+            posting = postings.get(feature, array('I'))
+            position = bisect_left(posting, recipe_id)
+            if position < len(posting) and posting[position] == recipe_id:
+                continue
+            posting = array('I', posting)
+            posting.insert(position, recipe_id)
+            postings[feature] = posting
+            size += 1
+
+        sizes[recipe_id] = size
+
+    def _change(self, recipe_id, added, removed):
+        with self._lock:
+            if self._pending is not None:
+                self._pending.append((recipe_id, added, removed))
+            if self._postings is not None:
+                self._apply(
+                    self._postings, self._sizes, recipe_id, added, removed
+                )
+
+    def update_recipe(self, recipe_id, added=(), removed=()):
+        """
+        Добавляет рецепт в списки признаков added и убирает из
+        removed. Списки заменяются копиями, чтобы параллельный поиск не
+        видел их изменёнными на полпути.
+        """
+        self._change(recipe_id, tuple(added), tuple(removed))
+
+    def discard_recipe(self, recipe_id):
+        """
+        Исключает удалённый рецепт из выдачи. Его id остаются в списках
+        признаков до перестройки, но без размера не учитываются.
+        """
+        self._change(recipe_id, (), None)
+
+    def search(self, ingredient_ids, missing=None, limit=SEARCH_LIMIT):
+        """
+        Рецепты, в которых есть хотя бы один из ingredient_ids, в виде
+        (recipe_id, matched, lacking). Сначала идут рецепты с наибольшей
+        долей имеющихся ингредиентов. С missing остаются только рецепты,
+        которым не хватает не более missing ингредиентов.
+        """
+        postings, sizes = self._get()
+        matched = Counter()
+        for ingredient_id in set(ingredient_ids):
+            matched.update(postings.get(ingredient_id, ()))
+
+        candidates = []
+        for recipe_id, count in matched.items():
+            size = sizes.get(recipe_id)
+            if not size:
+                continue
+            lacking = size - count
+            if missing is not None and lacking > missing:
+                continue
+            candidates.append((-count / size, lacking, recipe_id, count))
+
+        return [
+            (recipe_id, count, lacking)
+            for _, lacking, recipe_id, count in heapq.nsmallest(
+                limit, candidates
+            )
+        ]
+
+
+pantry_index = PantryIndex()
@@ -0,0 +1,80 @@
+"""
+Проверка планов основных запросов списка рецептов: запросы строятся тем
+же путём, что и в RecipeViewSet (RecipeFilter поверх with_related и
+with_user_flags), для каждого выполняется EXPLAIN и ищется ожидаемый
+индекс. SQLite называет индексы уникальных ограничений
+sqlite_autoindex_*. В PostgreSQL на время проверки отключается
+последовательное сканирование, иначе на маленьких таблицах планировщик
+выбирает его вместо индекса.
+"""
+from django.db import connection, transaction
+from django.test import RequestFactory
+
+from recipes.models import Recipe
+
+from .filters import RecipeFilter
+
+PAGE_SIZE = 10
+
+
+def recipe_page(user, **params):
+    """Первая страница списка рецептов с фильтрами params."""
+    request = RequestFactory().get('/api/recipes/', params)
+    request.user = user
+    queryset = Recipe.objects.with_related().with_user_flags(user)
+    return RecipeFilter(
+        request.GET, queryset=queryset, request=request
+    ).qs.order_by('-pub_date', '-id')[:PAGE_SIZE]
+
+
+def feed_queries(user, tag):
+    """Тройки (название, запрос, подходящие индексы)."""
+    return (
+        (
+            'Лента рецептов',
+            recipe_page(user),
+            ('recipe_pub_date_id_idx',),
+        ),
+        (
+            'Рецепты автора',
+            recipe_page(user, author=user.pk),
+            ('recipe_author_pub_date_idx',),
+        ),
+        (
+            'Рецепты по тегу',
+            recipe_page(user, tags=tag.slug),
+            ('unique_tag_recipe', 'sqlite_autoindex_recipes_recipetag'),
+        ),
+        (
+            'Избранное',
+            recipe_page(user, is_favorited=1),
+            ('unique_favorite', 'sqlite_autoindex_recipes_favorite'),
+        ),
+        (
+            'Список покупок',
+            recipe_page(user, is_in_shopping_cart=1),
+            (
+                'unique_shopping_cart',
+                'sqlite_autoindex_recipes_shoppingcart'
+            ),
+        ),
+    )
+
+
+def explain_feed(user, tag):
+    """
+    Планы запросов ленты в виде (название, план, индексы, использованные
+    индексы). Пустой список использованных означает, что ни один из
+    подходящих индексов в плане не найден.
+    """
+    results = []
+    with transaction.atomic():
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute('SET LOCAL enable_seqscan = off')
+
+        for title, queryset, indexes in feed_queries(user, tag):
+            plan = queryset.explain()
+            used = [index for index in indexes if index in plan]
+            results.append((title, plan, indexes, used))
+    return results
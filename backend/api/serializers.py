@@ -1,15 +1,43 @@
 from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models import prefetch_related_objects
 from djoser import serializers as djoser_serializers
 from rest_framework import serializers
 
-from recipes.models import (Favorite, Ingredient, Recipe, RecipeIngredient,
-                            RecipeTag, ShoppingCart, Subscription, Tag)
+from recipes.images import schedule_image_processing
+from recipes.models import (FeedEntry, Ingredient, Recipe, RecipeIngredient,
+                            RecipeTag, Tag, recipe_prefetches)
 
-from .custom_fields import Base64ImageField
+from .custom_fields import Base64ImageField, ImageSrcsetField
+from .pantry_index import pantry_index
+from .similar_index import ingredient_feature, similar_index, tag_feature
+from .utils import get_recipes_limit
+from .viewer import get_viewer_context
 
 User = get_user_model()
 
 
+class ViewerListSerializer(serializers.ListSerializer):
+    """
+    Список объектов с флагами текущего пользователя. Для объектов без
+    аннотации флага id всей страницы передаются в ViewerContext.prime до
+    вывода, и каждый набор проверяется одним запросом.
+    """
+
+    def to_representation(self, data):
+        items = list(data.all() if hasattr(data, 'all') else data)
+        request = self.context.get('request')
+        if request is not None:
+            viewer = get_viewer_context(request)
+            for attribute, kind in self.child.viewer_flags.items():
+                ids = [
+                    item.pk for item in items if not hasattr(item, attribute)
+                ]
+                if ids:
+                    viewer.prime(kind, ids)
+        return super().to_representation(items)
+
+
 class UserCreateSerializer(djoser_serializers.UserCreateSerializer):
     """Сериализация создания пользователя"""
 
@@ -33,9 +61,11 @@ class UserCreateSerializer(djoser_serializers.UserCreateSerializer):
 class UserSerializer(djoser_serializers.UserSerializer):
     """Сериализация пользователей"""
     is_subscribed = serializers.SerializerMethodField()
+    viewer_flags = {'is_subscribed': 'subscriptions'}
 
     class Meta:
         model = User
+        list_serializer_class = ViewerListSerializer
         fields = (
             'id',
             'email',
@@ -46,13 +76,11 @@ class UserSerializer(djoser_serializers.UserSerializer):
         )
 
     def get_is_subscribed(self, obj):
-        request = self.context.get('request')
-        user = request.user
-
-        if not user or user.is_anonymous:
-            return False
+        if hasattr(obj, 'is_subscribed'):
+            return obj.is_subscribed
 
-        return Subscription.objects.filter(user=user, author=obj).exists()
+        request = self.context.get('request')
+        return get_viewer_context(request).is_subscribed(obj.pk)
 
 
 class UserWithRecipesSerializer(serializers.ModelSerializer):
@@ -74,25 +102,24 @@ class UserWithRecipesSerializer(serializers.ModelSerializer):
         )
 
     def get_is_subscribed(self, obj):
-        request = self.context.get('request')
-        user = request.user
-
-        if not user or user.is_anonymous:
-            return False
+        if hasattr(obj, 'is_subscribed'):
+            return obj.is_subscribed
 
-        return Subscription.objects.filter(user=user, author=obj).exists()
-
-    def get_recipes(self, obj):
         request = self.context.get('request')
-        limit = request.query_params.get('recipes_limit')
-        queryset = Recipe.objects.filter(author=obj)
+        return get_viewer_context(request).is_subscribed(obj.pk)
 
-        if limit:
-            queryset = queryset[:int(limit)]
+    def get_recipes(self, obj):
+        recipes = getattr(obj, 'recipes_preview', None)
+        if recipes is None:
+            limit = get_recipes_limit(self.context.get('request'))
+            recipes = Recipe.objects.filter(author=obj)[:limit]
 
-        return RecipeInShortSerializer(queryset, many=True).data
+        return RecipeInShortSerializer(recipes, many=True).data
 
     def get_recipes_count(self, obj):
+        if hasattr(obj, 'recipes_count'):
+            return obj.recipes_count
+
         return obj.recipes.count()
 
 
@@ -156,9 +183,15 @@ class RecipeSerializer(serializers.ModelSerializer):
     )
     is_favorited = serializers.SerializerMethodField()
     is_in_shopping_cart = serializers.SerializerMethodField()
+    image_srcset = ImageSrcsetField()
+    viewer_flags = {
+        'is_favorited': 'favorites',
+        'is_in_shopping_cart': 'shopping_cart',
+    }
 
     class Meta:
         model = Recipe
+        list_serializer_class = ViewerListSerializer
         fields = (
             'id',
             'tags',
@@ -168,33 +201,29 @@ class RecipeSerializer(serializers.ModelSerializer):
             'is_in_shopping_cart',
             'name',
             'image',
+            'image_srcset',
             'text',
             'cooking_time'
         )
 
     def get_is_favorited(self, obj):
-        request = self.context.get('request')
-        user = request.user
+        if hasattr(obj, 'is_favorited'):
+            return obj.is_favorited
 
-        if not user or user.is_anonymous:
-            return False
-
-        queryset = Favorite.objects.filter(user=user, recipe=obj)
-        return queryset.exists()
-
-    def get_is_in_shopping_cart(self, obj):
         request = self.context.get('request')
-        user = request.user
+        return get_viewer_context(request).is_favorited(obj.pk)
 
-        if not user or user.is_anonymous:
-            return False
+    def get_is_in_shopping_cart(self, obj):
+        if hasattr(obj, 'is_in_shopping_cart'):
+            return obj.is_in_shopping_cart
 
-        queryset = ShoppingCart.objects.filter(user=user, recipe=obj)
-        return queryset.exists()
+        request = self.context.get('request')
+        return get_viewer_context(request).is_in_shopping_cart(obj.pk)
 
 
 class RecipeInShortSerializer(serializers.ModelSerializer):
     """Сериализация добавления рецепта в избранное"""
+    image_srcset = ImageSrcsetField()
 
     class Meta:
         model = Recipe
@@ -202,10 +231,33 @@ class RecipeInShortSerializer(serializers.ModelSerializer):
             'id',
             'name',
             'image',
+            'image_srcset',
             'cooking_time'
         )
 
 
+class RecipeIdsSerializer(serializers.Serializer):
+    """Сериализация списка рецептов для массовых операций"""
+    recipes = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False,
+        max_length=100,
+    )
+
+
+class PantrySerializer(serializers.Serializer):
+    """Сериализация параметров поиска рецептов по имеющимся продуктам"""
+    ingredients = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False,
+        max_length=100,
+    )
+    missing = serializers.IntegerField(
+        min_value=0,
+        required=False,
+    )
+
+
 class RecipeIngredientCreateSerializer(serializers.ModelSerializer):
     """Сериализация ингредиентов рецепта для создания рецепта"""
     id = serializers.IntegerField(source='ingredient.id')
@@ -221,9 +273,8 @@ class RecipeIngredientCreateSerializer(serializers.ModelSerializer):
 class RecipeCreateSerializer(serializers.ModelSerializer):
     """Сериализация создания рецепта"""
 
-    tags = serializers.PrimaryKeyRelatedField(
-        queryset=Tag.objects.all(),
-        many=True,
+    tags = serializers.ListField(
+        child=serializers.IntegerField(),
     )
     ingredients = RecipeIngredientCreateSerializer(
         many=True,
@@ -243,6 +294,60 @@ class RecipeCreateSerializer(serializers.ModelSerializer):
         )
         read_only_fields = ('author',)
 
+    def validate_tags(self, value):
+        if len(set(value)) != len(value):
+            raise serializers.ValidationError('Теги не должны повторяться')
+
+        tags = Tag.objects.in_bulk(value)
+        missing = [tag_id for tag_id in value if tag_id not in tags]
+        if missing:
+            raise serializers.ValidationError(
+                f'Несуществующие теги: {missing}'
+            )
+
+        return [tags[tag_id] for tag_id in value]
+
+    def validate_ingredients(self, value):
+        ids = [ingredient['ingredient']['id'] for ingredient in value]
+        if len(set(ids)) != len(ids):
+            raise serializers.ValidationError(
+                'Ингредиенты не должны повторяться'
+            )
+
+        existing = set(
+            Ingredient.objects.filter(id__in=ids).values_list('id', flat=True)
+        )
+        missing = [
+            ingredient_id for ingredient_id in ids
+            if ingredient_id not in existing
+        ]
+        if missing:
+            raise serializers.ValidationError(
+                f'Несуществующие ингредиенты: {missing}'
+            )
+
+        return value
+
+    def index_tags(self, recipe, added, removed=()):
+        """После коммита переносит изменения тегов в индекс похожих."""
+        transaction.on_commit(lambda: similar_index.update_recipe(
+            recipe.pk,
+            added=[tag_feature(tag_id) for tag_id in added],
+            removed=[tag_feature(tag_id) for tag_id in removed]
+        ))
+
+    def index_ingredients(self, recipe, added, removed=()):
+        """После коммита переносит изменения ингредиентов в индексы."""
+        def update():
+            pantry_index.update_recipe(recipe.pk, added, removed)
+            similar_index.update_recipe(
+                recipe.pk,
+                added=[ingredient_feature(pk) for pk in added],
+                removed=[ingredient_feature(pk) for pk in removed]
+            )
+
+        transaction.on_commit(update)
+
     def create_tags(self, recipe, tags):
         recipe_tags = []
         for tag in tags:
@@ -251,6 +356,7 @@ class RecipeCreateSerializer(serializers.ModelSerializer):
                 tag=tag
             ))
         RecipeTag.objects.bulk_create(recipe_tags)
+        self.index_tags(recipe, added=[tag.pk for tag in tags])
 
     def create_ingredients(self, recipe, ingredients):
         recipe_ingredients = []
@@ -261,33 +367,120 @@ class RecipeCreateSerializer(serializers.ModelSerializer):
                 recipe=recipe,
             ))
         RecipeIngredient.objects.bulk_create(recipe_ingredients)
+        self.index_ingredients(
+            recipe,
+            added=[item.ingredient_id for item in recipe_ingredients]
+        )
+
+    def update_tags(self, recipe, tags):
+        new_tags = {tag.pk for tag in tags}
+        current_tags = set(
+            RecipeTag.objects.filter(
+                recipe=recipe
+            ).order_by().values_list('tag_id', flat=True)
+        )
+
+        removed = current_tags - new_tags
+        if removed:
+            RecipeTag.objects.filter(
+                recipe=recipe,
+                tag_id__in=removed
+            ).delete()
+        RecipeTag.objects.bulk_create([
+            RecipeTag(recipe=recipe, tag_id=tag_id)
+            for tag_id in new_tags - current_tags
+        ])
+        self.index_tags(
+            recipe,
+            added=list(new_tags - current_tags),
+            removed=list(removed)
+        )
+
+    def update_ingredients(self, recipe, ingredients):
+        amounts = {
+            ingredient['ingredient'].get('id'): ingredient['amount']
+            for ingredient in ingredients
+        }
+        current = {
+            recipe_ingredient.ingredient_id: recipe_ingredient
+            for recipe_ingredient in RecipeIngredient.objects.filter(
+                recipe=recipe
+            ).order_by()
+        }
 
+        removed = current.keys() - amounts.keys()
+        if removed:
+            RecipeIngredient.objects.filter(
+                recipe=recipe,
+                ingredient_id__in=removed
+            ).delete()
+
+        changed = []
+        for ingredient_id, recipe_ingredient in current.items():
+            amount = amounts.get(ingredient_id)
+            if amount is not None and recipe_ingredient.amount != amount:
+                recipe_ingredient.amount = amount
+                changed.append(recipe_ingredient)
+        RecipeIngredient.objects.bulk_update(changed, ['amount'])
+
+        RecipeIngredient.objects.bulk_create([
+            RecipeIngredient(
+                recipe=recipe,
+                ingredient_id=ingredient_id,
+                amount=amount
+            )
+            for ingredient_id, amount in amounts.items()
+            if ingredient_id not in current
+        ])
+        self.index_ingredients(
+            recipe,
+            added=list(amounts.keys() - current.keys()),
+            removed=list(removed)
+        )
+
+    @transaction.atomic
     def create(self, validated_data):
         tags = validated_data.pop('tags')
         ingredients = validated_data.pop('ingredients')
+        validated_data['ingredients_count'] = len(ingredients)
 
         recipe = super().create(validated_data)
 
         self.create_tags(recipe, tags)
         self.create_ingredients(recipe, ingredients)
+        FeedEntry.objects.add_recipe(recipe)
+        schedule_image_processing(recipe.pk)
 
         return recipe
 
+    @transaction.atomic
     def update(self, instance, validated_data):
-        RecipeTag.objects.filter(recipe=instance).delete()
-        RecipeIngredient.objects.filter(recipe=instance).delete()
-
-        tags = validated_data.pop('tags')
-        ingredients = validated_data.pop('ingredients')
-
-        recipe = super().update(instance, validated_data)
-
-        self.create_tags(recipe, tags)
-        self.create_ingredients(recipe, ingredients)
+        tags = validated_data.pop('tags', None)
+        ingredients = validated_data.pop('ingredients', None)
+        if ingredients is not None:
+            validated_data['ingredients_count'] = len(ingredients)
+        if 'image' in validated_data:
+            validated_data['image_hash'] = ''
+            validated_data['image_width'] = 0
+
+        for field, value in validated_data.items():
+            setattr(instance, field, value)
+        instance.save(update_fields=list(validated_data))
+        recipe = instance
+
+        if tags is not None:
+            self.update_tags(recipe, tags)
+        if ingredients is not None:
+            self.update_ingredients(recipe, ingredients)
+        if 'image' in validated_data:
+            schedule_image_processing(recipe.pk)
 
         return recipe
 
     def to_representation(self, instance):
+        # После обновления DRF сбрасывает подгруженные связи рецепта.
+        if not getattr(instance, '_prefetched_objects_cache', None):
+            prefetch_related_objects([instance], *recipe_prefetches())
         return RecipeSerializer(
             instance, context={'request': self.context.get('request')}
         ).data
@@ -0,0 +1,50 @@
+from django.contrib.auth import get_user_model
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
+
+from recipes.models import Ingredient, Recipe, Tag
+
+from .authentication import cache as token_cache
+from .authentication import token_cache_key
+from .cache import bump_version
+from .ingredient_index import ingredient_index
+from .pantry_index import pantry_index
+from .similar_index import similar_index
+
+User = get_user_model()
+
+
+@receiver(post_save, sender=Ingredient)
+@receiver(post_delete, sender=Ingredient)
+def invalidate_ingredient_index(sender, **kwargs):
+    ingredient_index.invalidate()
+
+
+@receiver(post_save, sender=Ingredient)
+@receiver(post_delete, sender=Ingredient)
+def invalidate_ingredient_responses(sender, **kwargs):
+    bump_version('ingredients')
+
+
+@receiver(post_delete, sender=Recipe)
+def discard_pantry_recipe(sender, instance, **kwargs):
+    pantry_index.discard_recipe(instance.pk)
+    similar_index.discard_recipe(instance.pk)
+
+
+@receiver(post_save, sender=Tag)
+@receiver(post_delete, sender=Tag)
+def invalidate_tag_responses(sender, **kwargs):
+    bump_version('tags')
+
+
+@receiver(post_delete, sender=Token)
+def invalidate_cached_token(sender, instance, **kwargs):
+    token_cache.delete(token_cache_key(instance.key))
+
+
+@receiver(post_save, sender=User)
+def invalidate_cached_user_tokens(sender, instance, **kwargs):
+    keys = Token.objects.filter(user=instance).values_list('key', flat=True)
+    token_cache.delete_many([token_cache_key(key) for key in keys])
@@ -0,0 +1,122 @@
+import heapq
+import math
+from array import array
+from collections import Counter, OrderedDict
+
+from recipes.models import RecipeTag
+
+from .pantry_index import PantryIndex, pantry_index
+
+SIMILAR_LIMIT = 20
+RESULTS_CACHE_SIZE = 2000
+
+
+def ingredient_feature(ingredient_id):
+    return ('ingredient', ingredient_id)
+
+
+def tag_feature(tag_id):
+    return ('tag', tag_id)
+
+
+class SimilarityIndex(PantryIndex):
+    """
+    Обратный индекс «ингредиент или тег → рецепты» для поиска похожих
+    рецептов. Рецепт рассматривается как двоичный вектор признаков,
+    поэтому косинусная близость двух рецептов равна числу общих
+    признаков, делённому на корень из произведения их количеств.
+    Пересечения со всеми рецептами считаются одним проходом по спискам
+    признаков исходного рецепта, без построения матрицы. Признаки
+    ингредиентов разделяются с индексом поиска по ингредиентам.
+    """
+
+    def __init__(self, ingredients, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.ingredients = ingredients
+        self._results = OrderedDict()
+        self._results_built_at = 0
+
+    def get_features(self):
+        return (
+            (tag_feature(tag_id), recipe_id)
+            for tag_id, recipe_id in RecipeTag.objects.order_by(
+                'recipe_id'
+            ).values_list('tag_id', 'recipe_id').iterator()
+        )
+
+    def _build(self):
+        """
+        Списки ингредиентов берутся из индекса ingredients, а не вторым
+        чтением RecipeIngredient: массивы в обоих индексах заменяются
+        копиями и не меняются на месте, поэтому их можно разделять.
+        Из базы читаются только теги.
+        """
+        self.ingredients.rebuild()
+        with self.ingredients._lock:
+            ingredient_postings = dict(self.ingredients._postings)
+            sizes = Counter(self.ingredients._sizes)
+
+        postings = {
+            ingredient_feature(ingredient_id): posting
+            for ingredient_id, posting in ingredient_postings.items()
+        }
+        for feature, recipe_id in self.get_features():
+            if feature not in postings:
+                postings[feature] = array('I')
+            postings[feature].append(recipe_id)
+            sizes[recipe_id] += 1
+        return postings, dict(sizes)
+
+    def update_recipe(self, recipe_id, added=(), removed=()):
+        super().update_recipe(recipe_id, added, removed)
+        with self._lock:
+            self._results.clear()
+
+    def discard_recipe(self, recipe_id):
+        super().discard_recipe(recipe_id)
+        with self._lock:
+            self._results.clear()
+
+    def similar(self, recipe_id, features, limit=SIMILAR_LIMIT):
+        """
+        До limit рецептов, наиболее похожих на рецепт с признаками
+        features, в виде (recipe_id, similarity) по убыванию близости.
+        Последние RESULTS_CACHE_SIZE результатов запоминаются до
+        следующего изменения индекса.
+        """
+        postings, sizes = self._get()
+        if self._results_built_at != self._built_at:
+            with self._lock:
+                self._results.clear()
+                self._results_built_at = self._built_at
+
+        key = (recipe_id, limit)
+        result = self._results.get(key)
+        if result is not None:
+            return result
+
+        features = set(features)
+        shared = Counter()
+        for feature in features:
+            shared.update(postings.get(feature, ()))
+        shared.pop(recipe_id, None)
+
+        norm = len(features)
+        scored = (
+            (count / math.sqrt(norm * sizes[other]), -other)
+            for other, count in shared.items()
+            if sizes.get(other)
+        )
+        result = [
+            (-negative_id, similarity)
+            for similarity, negative_id in heapq.nlargest(limit, scored)
+        ]
+
+        with self._lock:
+            self._results[key] = result
+            if len(self._results) > RESULTS_CACHE_SIZE:
+                self._results.popitem(last=False)
+        return result
+
+
+similar_index = SimilarityIndex(pantry_index)
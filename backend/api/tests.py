@@ -0,0 +1,484 @@
+import base64
+import os
+import shutil
+import tempfile
+import threading
+import time
+from array import array
+from io import BytesIO, StringIO
+from unittest import mock, skipUnless
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from PIL import Image
+from rest_framework.test import APIClient
+
+from recipes.models import (FeedEntry, Ingredient, Recipe, RecipeIngredient,
+                            RecipeTag, Subscription, Tag)
+
+from .custom_fields import DECODE_CHUNK_SIZE, Base64ImageField
+from .pantry_index import PantryIndex
+from .plans import explain_feed
+from .similar_index import SimilarityIndex, ingredient_feature, tag_feature
+
+User = get_user_model()
+TEMP_MEDIA_ROOT = tempfile.mkdtemp()
+
+
+def create_user(username):
+    return User.objects.create_user(
+        username=username,
+        email=f'{username}@example.com',
+        password='password',
+        first_name=username,
+        last_name=username,
+    )
+
+
+def create_recipe(author, name='Рецепт', **kwargs):
+    return Recipe.objects.create(
+        author=author,
+        name=name,
+        text='Описание',
+        cooking_time=10,
+        image='recipes/image.jpg',
+        **kwargs
+    )
+
+
+def image_data():
+    buffer = BytesIO()
+    Image.new('RGB', (2, 2)).save(buffer, 'PNG')
+    return 'data:image/png;base64,' + base64.b64encode(
+        buffer.getvalue()
+    ).decode()
+
+
+class RecipeQueryCountTest(TestCase):
+    """Число запросов к рецептам не зависит от размера страницы."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user('reader')
+        tags = [
+            Tag.objects.create(
+                name=f'Тег {number}',
+                color=f'#00000{number}',
+                slug=f'tag{number}'
+            )
+            for number in range(2)
+        ]
+        ingredients = [
+            Ingredient.objects.create(name=f'Ингредиент {number}',
+                                      measurement_unit='г')
+            for number in range(3)
+        ]
+        authors = [create_user(f'author{number}') for number in range(15)]
+        for number in range(120):
+            author = authors[number % 15]
+            recipe = create_recipe(author, name=f'Рецепт {number}')
+            RecipeTag.objects.bulk_create(
+                RecipeTag(recipe=recipe, tag=tag) for tag in tags
+            )
+            RecipeIngredient.objects.bulk_create(
+                RecipeIngredient(recipe=recipe, ingredient=ingredient,
+                                 amount=number + 1)
+                for ingredient in ingredients
+            )
+            if number % 3 == 0:
+                Subscription.objects.get_or_create(user=cls.user,
+                                                   author=author)
+        cls.recipe = recipe
+
+    def get_client(self, authenticated):
+        client = APIClient()
+        if authenticated:
+            client.force_authenticate(self.user)
+        return client
+
+    def test_list(self):
+        cases = (
+            (False, 10, 4),
+            (False, 100, 4),
+            (True, 10, 5),
+            (True, 100, 5),
+        )
+        for authenticated, limit, queries in cases:
+            with self.subTest(authenticated=authenticated, limit=limit):
+                client = self.get_client(authenticated)
+                with self.assertNumQueries(queries):
+                    response = client.get('/api/recipes/', {'limit': limit})
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(len(response.data['results']), limit)
+
+    def test_search_vector_not_selected(self):
+        client = self.get_client(True)
+        for url in ('/api/recipes/', f'/api/recipes/{self.recipe.pk}/'):
+            with self.subTest(url=url):
+                with CaptureQueriesContext(connection) as context:
+                    response = client.get(url)
+                self.assertEqual(response.status_code, 200)
+                for query in context.captured_queries:
+                    self.assertNotIn('search_vector', query['sql'])
+
+    def test_detail(self):
+        for authenticated, queries in ((False, 3), (True, 4)):
+            with self.subTest(authenticated=authenticated):
+                client = self.get_client(authenticated)
+                with self.assertNumQueries(queries):
+                    response = client.get(f'/api/recipes/{self.recipe.pk}/')
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(len(response.data['ingredients']), 3)
+
+
+class RecipeUpdateTest(TestCase):
+    """PATCH рецепта меняет только те строки связей, что изменились."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = create_user('author')
+        cls.tags = [
+            Tag.objects.create(
+                name=f'Тег {number}',
+                color=f'#00000{number}',
+                slug=f'tag{number}'
+            )
+            for number in range(3)
+        ]
+        cls.ingredients = [
+            Ingredient.objects.create(name=f'Ингредиент {number}',
+                                      measurement_unit='г')
+            for number in range(4)
+        ]
+        cls.recipe = create_recipe(cls.author, ingredients_count=3)
+        RecipeTag.objects.bulk_create(
+            RecipeTag(recipe=cls.recipe, tag=tag) for tag in cls.tags[:2]
+        )
+        RecipeIngredient.objects.bulk_create(
+            RecipeIngredient(recipe=cls.recipe, ingredient=ingredient,
+                             amount=10)
+            for ingredient in cls.ingredients[:3]
+        )
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.author)
+        self.url = f'/api/recipes/{self.recipe.pk}/'
+
+    def get_rows(self):
+        tags = dict(
+            RecipeTag.objects.filter(
+                recipe=self.recipe
+            ).values_list('tag_id', 'id')
+        )
+        ingredients = {
+            ingredient_id: (pk, amount)
+            for ingredient_id, pk, amount in RecipeIngredient.objects.filter(
+                recipe=self.recipe
+            ).values_list('ingredient_id', 'id', 'amount')
+        }
+        return tags, ingredients
+
+    def test_title_only_patch_keeps_relations(self):
+        tags, ingredients = self.get_rows()
+        with self.assertNumQueries(9):
+            response = self.client.patch(
+                self.url, {'name': 'Новое название'}, format='json'
+            )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['name'], 'Новое название')
+        self.assertEqual(self.get_rows(), (tags, ingredients))
+
+    def test_mixed_patch_touches_only_changed_rows(self):
+        tags, ingredients = self.get_rows()
+        first, second, third, fourth = (
+            ingredient.pk for ingredient in self.ingredients
+        )
+        with self.assertNumQueries(18):
+            response = self.client.patch(self.url, {
+                'tags': [self.tags[1].pk, self.tags[2].pk],
+                'ingredients': [
+                    {'id': first, 'amount': 10},
+                    {'id': second, 'amount': 25},
+                    {'id': fourth, 'amount': 5},
+                ],
+            }, format='json')
+        self.assertEqual(response.status_code, 200)
+
+        new_tags, new_ingredients = self.get_rows()
+        self.assertEqual(new_tags.keys(), {self.tags[1].pk, self.tags[2].pk})
+        self.assertEqual(new_tags[self.tags[1].pk], tags[self.tags[1].pk])
+        self.assertEqual(new_ingredients.keys(), {first, second, fourth})
+        self.assertEqual(new_ingredients[first], ingredients[first])
+        self.assertEqual(new_ingredients[second],
+                         (ingredients[second][0], 25))
+        self.assertEqual(new_ingredients[fourth][1], 5)
+        self.assertNotIn(third, new_ingredients)
+        self.recipe.refresh_from_db()
+        self.assertEqual(self.recipe.ingredients_count, 3)
+
+
+class ViewerFlagsTest(TestCase):
+    """Флаги подписки в списке пользователей проверяются для всей страницы."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user('reader')
+        cls.user.is_staff = True
+        cls.user.save()
+        cls.authors = [create_user(f'author{number}') for number in range(12)]
+        for author in cls.authors[::2]:
+            Subscription.objects.create(user=cls.user, author=author)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    @mock.patch('api.viewer.MAX_PRELOADED_IDS', 2)
+    def test_subscriptions_over_preload_limit(self):
+        expected = {author.pk for author in self.authors[::2]}
+        for limit in (5, 13):
+            with self.subTest(limit=limit):
+                with self.assertNumQueries(4):
+                    response = self.client.get('/api/users/',
+                                               {'limit': limit})
+                self.assertEqual(response.status_code, 200)
+                results = response.data['results']
+                self.assertEqual(len(results), limit)
+                for user in results:
+                    self.assertEqual(user['is_subscribed'],
+                                     user['id'] in expected)
+
+
+class RecipeIndexTest(TestCase):
+    """Индексы рецептов перестраиваются без остановки поиска."""
+
+    def test_stale_index_served_during_rebuild(self):
+        index = PantryIndex(ttl=60)
+        index._postings, index._sizes = {1: array('I', [10])}, {10: 1}
+        index._built_at = time.monotonic() - 120
+        started, release = threading.Event(), threading.Event()
+
+        def build():
+            started.set()
+            release.wait(5)
+            return {1: array('I', [10, 12])}, {10: 1, 12: 2}
+
+        with mock.patch.object(index, '_build', side_effect=build):
+            self.assertEqual(index.search([1]), [(10, 1, 0)])
+            self.assertTrue(started.wait(5))
+            self.assertEqual(index.search([1]), [(10, 1, 0)])
+            index.update_recipe(11, added=[1])
+            release.set()
+            self.assertTrue(index._rebuild_lock.acquire(timeout=5))
+            index._rebuild_lock.release()
+
+        self.assertEqual(
+            index.search([1]), [(10, 1, 0), (11, 1, 0), (12, 1, 1)]
+        )
+
+    def test_similarity_index_reuses_ingredient_scan(self):
+        author = create_user('author')
+        tag = Tag.objects.create(name='Завтрак', color='#E26C2D',
+                                 slug='breakfast')
+        ingredients = [
+            Ingredient.objects.create(name=f'Ингредиент {number}',
+                                      measurement_unit='г')
+            for number in range(3)
+        ]
+        recipes = [
+            create_recipe(author, name=f'Рецепт {number}')
+            for number in range(3)
+        ]
+        for recipe, used in zip(recipes, ((0, 1), (0, 1), (2,))):
+            RecipeTag.objects.create(recipe=recipe, tag=tag)
+            RecipeIngredient.objects.bulk_create(
+                RecipeIngredient(recipe=recipe, ingredient=ingredients[i],
+                                 amount=1)
+                for i in used
+            )
+
+        pantry = PantryIndex()
+        pantry.rebuild()
+        similar = SimilarityIndex(pantry)
+        with self.assertNumQueries(1):
+            similar.rebuild()
+
+        features = [
+            ingredient_feature(ingredients[0].pk),
+            ingredient_feature(ingredients[1].pk),
+            tag_feature(tag.pk),
+        ]
+        result = similar.similar(recipes[0].pk, features)
+        self.assertEqual([pk for pk, _ in result],
+                         [recipes[1].pk, recipes[2].pk])
+        self.assertAlmostEqual(result[0][1], 1.0)
+
+
+class SubscriptionsQueryCountTest(TestCase):
+    """Страница подписок не зависит по числу запросов от recipes_limit."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user('reader')
+        for number in range(3):
+            author = create_user(f'author{number}')
+            Subscription.objects.create(user=cls.user, author=author)
+            for _ in range(4):
+                create_recipe(author, image_hash='0123456789abcdef')
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_query_count_does_not_grow_with_recipes_limit(self):
+        for limit in (1, 3, 4):
+            with self.subTest(recipes_limit=limit):
+                with self.assertNumQueries(3):
+                    response = self.client.get(
+                        '/api/users/subscriptions/',
+                        {'recipes_limit': limit}
+                    )
+                self.assertEqual(response.status_code, 200)
+                for author in response.data['results']:
+                    self.assertEqual(len(author['recipes']), limit)
+                    self.assertTrue(author['recipes'][0]['image_srcset'])
+
+
+class Base64ImageFieldTest(TestCase):
+    """Изображение в base64 принимается и с переносами строк."""
+
+    def test_line_wrapped_payload(self):
+        buffer = BytesIO()
+        Image.frombytes(
+            'RGB', (200, 200), os.urandom(200 * 200 * 3)
+        ).save(buffer, 'PNG')
+        content = buffer.getvalue()
+        self.assertGreater(len(content), DECODE_CHUNK_SIZE)
+
+        wrapped = base64.encodebytes(content).decode()
+        data = Base64ImageField().to_internal_value(
+            'data:image/png;base64,' + wrapped
+        )
+        data.seek(0)
+        self.assertEqual(data.read(), content)
+
+
+class ImageSrcsetTest(TestCase):
+    """Варианты шире исходного изображения не попадают в srcset."""
+
+    def test_widths_are_clamped_to_image_width(self):
+        recipe = create_recipe(
+            create_user('author'),
+            image_hash='0123456789abcdef',
+            image_width=500
+        )
+        response = APIClient().get(f'/api/recipes/{recipe.pk}/')
+
+        srcset = response.data['image_srcset']['webp']
+        self.assertIn('_320.webp 320w', srcset)
+        self.assertIn('_500.webp 500w', srcset)
+        self.assertNotIn('640w', srcset)
+        self.assertNotIn('1280w', srcset)
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
+class StoredFeedTest(TestCase):
+    """Собранная лента подписок остаётся актуальной между пересборками."""
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user('reader')
+        other = create_user('other')
+        cls.authors = [create_user(f'author{number}') for number in range(2)]
+        for author in cls.authors:
+            Subscription.objects.create(user=cls.user, author=author)
+            Subscription.objects.create(user=other, author=author)
+        cls.recipes = [
+            create_recipe(cls.authors[number % 2], name=f'Рецепт {number}')
+            for number in range(6)
+        ]
+        call_command(
+            'build_feeds', min_subscriptions=1, size=3, stdout=StringIO()
+        )
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def read_feed(self):
+        ids, url = [], '/api/recipes/feed/?limit=2'
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            ids += [recipe['id'] for recipe in response.data['results']]
+            url = response.data['next']
+        return ids
+
+    def test_feed_continues_past_stored_entries(self):
+        self.assertEqual(FeedEntry.objects.filter(user=self.user).count(), 3)
+        self.assertEqual(
+            self.read_feed(),
+            [recipe.pk for recipe in reversed(self.recipes)]
+        )
+
+    def test_new_recipe_appears_in_feed(self):
+        author = self.authors[0]
+        tag = Tag.objects.create(name='Тег', color='#FFFFFF', slug='tag')
+        ingredient = Ingredient.objects.create(
+            name='Соль', measurement_unit='г'
+        )
+        client = APIClient()
+        client.force_authenticate(author)
+        response = client.post('/api/recipes/', {
+            'name': 'Новый',
+            'text': 'Описание',
+            'cooking_time': 5,
+            'image': image_data(),
+            'tags': [tag.pk],
+            'ingredients': [{'id': ingredient.pk, 'amount': 1}],
+        }, format='json')
+        self.assertEqual(response.status_code, 201)
+
+        self.assertEqual(self.read_feed()[0], response.data['id'])
+
+    def test_unsubscribe_and_subscribe_update_feed(self):
+        author = self.authors[1]
+        own = {recipe.pk for recipe in self.recipes if recipe.author == author}
+
+        response = self.client.delete(f'/api/users/{author.pk}/subscribe/')
+        self.assertEqual(response.status_code, 204)
+        self.assertFalse(own & set(self.read_feed()))
+
+        response = self.client.post(f'/api/users/{author.pk}/subscribe/')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(
+            self.read_feed(),
+            [recipe.pk for recipe in reversed(self.recipes)]
+        )
+
+
+@skipUnless(connection.vendor == 'postgresql', 'Нужен PostgreSQL')
+class FeedPlanTest(TestCase):
+    """Запросы списка рецептов используют свои индексы."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user('reader')
+        cls.tag = Tag.objects.create(name='Завтрак', color='#E26C2D',
+                                     slug='breakfast')
+
+    def test_feed_queries_use_indexes(self):
+        for title, plan, indexes, used in explain_feed(self.user, self.tag):
+            with self.subTest(query=title):
+                self.assertTrue(
+                    used, f'не используется {", ".join(indexes)}:\n{plan}'
+                )
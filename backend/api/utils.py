@@ -0,0 +1,105 @@
+import csv
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db.models import Sum
+from rest_framework.exceptions import ValidationError
+
+from recipes.models import Recipe, RecipeIngredient
+
+SHOPPING_CART_FILENAME = 'shopping_cart'
+RECIPES_LIMIT_MAX = 20
+TRENDING_CACHE_KEY = 'recipes:trending'
+
+
+class Echo:
+    """Псевдобуфер для csv.writer: возвращает строку вместо записи."""
+
+    def write(self, value):
+        return value
+
+
+def get_shopping_cart_ingredients(user):
+    """
+    Суммирует ингредиенты из списка покупок пользователя одним запросом.
+    Группировка идёт по названию и единице измерения, поэтому одинаковые
+    названия с разными единицами остаются отдельными строками.
+    """
+    return RecipeIngredient.objects.filter(
+        recipe__shopping_cart__user=user
+    ).values(
+        'ingredient__name',
+        'ingredient__measurement_unit'
+    ).annotate(
+        total_amount=Sum('amount')
+    ).order_by(
+        'ingredient__name',
+        'ingredient__measurement_unit'
+    )
+
+
+def shopping_cart_txt(ingredients):
+    for ingredient in ingredients.iterator():
+        yield (
+            f'{ingredient["ingredient__name"]} - '
+            f'{ingredient["total_amount"]} '
+            f'{ingredient["ingredient__measurement_unit"]}\n'
+        )
+
+
+def shopping_cart_csv(ingredients):
+    writer = csv.writer(Echo())
+    yield writer.writerow(('Ингредиент', 'Количество', 'Единица измерения'))
+    for ingredient in ingredients.iterator():
+        yield writer.writerow((
+            ingredient['ingredient__name'],
+            ingredient['total_amount'],
+            ingredient['ingredient__measurement_unit'],
+        ))
+
+
+SHOPPING_CART_FORMATS = {
+    'txt': (shopping_cart_txt, 'text/plain; charset=utf-8'),
+    'csv': (shopping_cart_csv, 'text/csv; charset=utf-8'),
+}
+
+
+def get_recipes_limit(request):
+    """
+    Количество рецептов в превью автора из параметра recipes_limit.
+    Без параметра и для больших значений используется RECIPES_LIMIT_MAX.
+    """
+    limit = request.query_params.get('recipes_limit')
+    if limit is None:
+        return RECIPES_LIMIT_MAX
+
+    try:
+        limit = int(limit)
+    except ValueError:
+        limit = -1
+    if limit < 0:
+        raise ValidationError(
+            {'recipes_limit': 'Ожидается неотрицательное целое число'}
+        )
+
+    return min(limit, RECIPES_LIMIT_MAX)
+
+
+def get_trending_ids():
+    """
+    Id самых популярных рецептов по убыванию trending_score. Список
+    читается по индексу и хранится в кэше TRENDING_CACHE_TTL секунд.
+    """
+    cache = caches[settings.API_CACHE_ALIAS]
+    ids = cache.get(TRENDING_CACHE_KEY)
+    if ids is None:
+        ids = list(
+            Recipe.objects.filter(
+                trending_score__gt=0
+            ).order_by('-trending_score', '-id').values_list(
+                'id', flat=True
+            )[:settings.TRENDING_SIZE]
+        )
+        cache.set(TRENDING_CACHE_KEY, ids, settings.TRENDING_CACHE_TTL)
+
+    return ids
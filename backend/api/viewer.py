@@ -0,0 +1,93 @@
+from recipes.models import Favorite, ShoppingCart, Subscription
+
+MAX_PRELOADED_IDS = 1000
+
+
+class ViewerContext:
+    """
+    Избранное, список покупок и подписки текущего пользователя, общие
+    для всех сериализаторов одного запроса. Каждый набор загружается
+    одним запросом при первом обращении. Если у пользователя больше
+    MAX_PRELOADED_IDS записей, набор не хранится целиком: проверяются
+    только запрошенные id, и ответы запоминаются. Списки вызывают prime
+    с id всей страницы, чтобы такая проверка шла одним запросом.
+    """
+
+    def __init__(self, user):
+        self.user = user
+        self._sets = {}
+        self._known = {}
+
+    def get_queryset(self, kind):
+        if kind == 'favorites':
+            return Favorite.objects.filter(user=self.user), 'recipe_id'
+        if kind == 'shopping_cart':
+            return ShoppingCart.objects.filter(user=self.user), 'recipe_id'
+        return Subscription.objects.filter(user=self.user), 'author_id'
+
+    def load(self, kind):
+        if kind in self._sets:
+            return self._sets[kind]
+
+        queryset, field = self.get_queryset(kind)
+        ids = list(
+            queryset.order_by().values_list(field, flat=True)[
+                :MAX_PRELOADED_IDS + 1
+            ]
+        )
+        if len(ids) > MAX_PRELOADED_IDS:
+            self._sets[kind] = None
+            self._known[kind] = {}
+        else:
+            self._sets[kind] = set(ids)
+
+        return self._sets[kind]
+
+    def prime(self, kind, ids):
+        """Проверяет сразу несколько id одним запросом."""
+        if self.user.is_anonymous or self.load(kind) is not None:
+            return
+
+        known = self._known[kind]
+        missing = [pk for pk in ids if pk not in known]
+        if not missing:
+            return
+
+        queryset, field = self.get_queryset(kind)
+        found = set(
+            queryset.filter(
+                **{f'{field}__in': missing}
+            ).values_list(field, flat=True)
+        )
+        for pk in missing:
+            known[pk] = pk in found
+
+    def contains(self, kind, pk):
+        if not self.user or self.user.is_anonymous:
+            return False
+
+        ids = self.load(kind)
+        if ids is not None:
+            return pk in ids
+
+        self.prime(kind, [pk])
+        return self._known[kind][pk]
+
+    def is_favorited(self, recipe_id):
+        return self.contains('favorites', recipe_id)
+
+    def is_in_shopping_cart(self, recipe_id):
+        return self.contains('shopping_cart', recipe_id)
+
+    def is_subscribed(self, author_id):
+        return self.contains('subscriptions', author_id)
+
+
+def get_viewer_context(request):
+    """Возвращает ViewerContext запроса, создавая его при первом вызове."""
+    http_request = getattr(request, '_request', request)
+    viewer = getattr(http_request, 'viewer_context', None)
+    if viewer is None or viewer.user != request.user:
+        viewer = ViewerContext(request.user)
+        http_request.viewer_context = viewer
+    return viewer
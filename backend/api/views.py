@@ -1,45 +1,75 @@
 from django.contrib.auth import get_user_model
-from django.http import HttpResponse
+from django.db import IntegrityError, transaction
+from django.db.models import BooleanField, Count, Value
+from django.http import StreamingHttpResponse
 from django.shortcuts import get_object_or_404
 from django_filters.rest_framework import DjangoFilterBackend
 from djoser import views as djoser_views
 from rest_framework import status
 from rest_framework.decorators import action
+from rest_framework.exceptions import NotFound
+from rest_framework.filters import OrderingFilter
 from rest_framework.response import Response
 from rest_framework.viewsets import ModelViewSet, ReadOnlyModelViewSet
 
-from recipes.models import (Favorite, Ingredient, Recipe, ShoppingCart,
-                            Subscription, Tag)
+from recipes.models import (Favorite, Feed, FeedEntry, Ingredient, Recipe,
+                            ShoppingCart, Subscription, Tag)
 
+from .cache import VersionedCacheMixin
 from .custom_permissions import (IsAuthenticated, IsAuthenticatedOrReadOnly,
                                  IsAuthorOrReadOnly)
-from .filters import IngredientFilter, RecipeFilter
-from .pagination import PageLimitPagination
-from .serializers import (IngredientSerializer, RecipeCreateSerializer,
-                          RecipeIngredient, RecipeInShortSerializer,
-                          RecipeSerializer, TagSerializer, UserSerializer,
+from .filters import RecipeFilter
+from .ingredient_index import ingredient_index
+from .pagination import FeedPagination, PageLimitPagination, RecipePagination
+from .pantry_index import SEARCH_LIMIT, pantry_index
+from .serializers import (IngredientSerializer, PantrySerializer,
+                          RecipeCreateSerializer, RecipeIdsSerializer,
+                          RecipeInShortSerializer, RecipeSerializer,
+                          TagSerializer, UserSerializer,
                           UserWithRecipesSerializer)
+from .similar_index import (SIMILAR_LIMIT, ingredient_feature, similar_index,
+                            tag_feature)
+from .utils import (SHOPPING_CART_FILENAME, SHOPPING_CART_FORMATS,
+                    get_recipes_limit, get_shopping_cart_ingredients,
+                    get_trending_ids)
 
 User = get_user_model()
 
 
-class TagViewSet(ReadOnlyModelViewSet):
+def parse_pk(pk):
+    try:
+        return int(pk)
+    except (TypeError, ValueError):
+        raise NotFound()
+
+
+class TagViewSet(VersionedCacheMixin, ReadOnlyModelViewSet):
     """API для работы с тегами."""
 
+    cache_group = 'tags'
     queryset = Tag.objects.all()
     serializer_class = TagSerializer
     pagination_class = None
 
 
-class IngredientViewSet(ReadOnlyModelViewSet):
+class IngredientViewSet(VersionedCacheMixin, ReadOnlyModelViewSet):
     """API для работы с ингредиентами."""
 
+    cache_group = 'ingredients'
     queryset = Ingredient.objects.all()
     serializer_class = IngredientSerializer
-    filter_backends = [IngredientFilter]
-    search_fields = ['^name']
     pagination_class = None
 
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(request, self.search)
+
+    def search(self, request):
+        name = request.query_params.get('name')
+        if not name:
+            return Response(ingredient_index.all())
+
+        return Response(ingredient_index.search(name))
+
 
 class RecipeViewSet(ModelViewSet):
     """API для работы с рецептами."""
@@ -50,9 +80,15 @@ class RecipeViewSet(ModelViewSet):
         IsAuthenticatedOrReadOnly,
         IsAuthorOrReadOnly
     )
-    pagination_class = PageLimitPagination
-    filter_backends = (DjangoFilterBackend,)
+    pagination_class = RecipePagination
+    filter_backends = (DjangoFilterBackend, OrderingFilter)
     filterset_class = RecipeFilter
+    ordering_fields = ('pub_date', 'favorites_count', 'cart_count')
+
+    def get_queryset(self):
+        return Recipe.objects.with_related().with_user_flags(
+            self.request.user
+        )
 
     def get_serializer_class(self):
         if self.action in ('create',
@@ -65,6 +101,113 @@ class RecipeViewSet(ModelViewSet):
     def perform_create(self, serializer):
         serializer.save(author=self.request.user)
 
+    @action(
+        detail=False,
+        methods=['get'],
+        permission_classes=[IsAuthenticated],
+        pagination_class=FeedPagination,
+        url_path='feed',
+    )
+    def feed(self, request):
+        queryset = self.filter_queryset(self.get_queryset())
+        live = queryset.feed(request.user)
+        stored = Feed.objects.filter(user=request.user).first()
+        if stored is None:
+            page = self.paginate_queryset(live)
+        else:
+            page = self.paginator.paginate_feed(
+                queryset,
+                request.user,
+                stored.since,
+                live.filter(pub_date__lt=stored.since),
+                request
+            )
+        serializer = self.get_serializer(page, many=True)
+
+        return self.get_paginated_response(serializer.data)
+
+    @action(
+        detail=False,
+        methods=['get'],
+        url_path='trending',
+    )
+    def trending(self, request):
+        ids = get_trending_ids()
+        limit = self.paginator.get_page_size(request)
+        if limit:
+            ids = ids[:limit]
+
+        recipes = self.get_queryset().in_bulk(ids)
+        serializer = self.get_serializer(
+            [recipes[pk] for pk in ids if pk in recipes],
+            many=True
+        )
+
+        return Response(serializer.data)
+
+    @action(
+        detail=False,
+        methods=['get'],
+        url_path='pantry',
+    )
+    def pantry(self, request):
+        """
+        Рецепты, которые можно приготовить из продуктов ingredients: по
+        убыванию доли имеющихся ингредиентов, с missing — только те,
+        которым не хватает не более missing ингредиентов.
+        """
+        params = PantrySerializer(data=request.query_params)
+        params.is_valid(raise_exception=True)
+        matches = pantry_index.search(
+            params.validated_data['ingredients'],
+            missing=params.validated_data.get('missing'),
+            limit=min(self.paginator.get_page_size(request), SEARCH_LIMIT)
+        )
+
+        recipes = self.get_queryset().in_bulk(
+            [recipe_id for recipe_id, _, _ in matches]
+        )
+        results = []
+        for recipe_id, matched, lacking in matches:
+            if recipe_id not in recipes:
+                continue
+            data = self.get_serializer(recipes[recipe_id]).data
+            data['matched_count'] = matched
+            data['missing_count'] = lacking
+            results.append(data)
+
+        return Response(results)
+
+    @action(
+        detail=True,
+        methods=['get'],
+        url_path='similar',
+    )
+    def similar(self, request, pk=None):
+        recipe = self.get_object()
+        features = [
+            ingredient_feature(item.ingredient_id)
+            for item in recipe.recipeingredient_set.all()
+        ] + [tag_feature(tag.pk) for tag in recipe.tags.all()]
+        matches = similar_index.similar(
+            recipe.pk,
+            features,
+            limit=min(self.paginator.get_page_size(request), SIMILAR_LIMIT)
+        )
+
+        recipes = self.get_queryset().in_bulk(
+            [recipe_id for recipe_id, _ in matches]
+        )
+        results = []
+        for recipe_id, similarity in matches:
+            if recipe_id not in recipes:
+                continue
+            data = self.get_serializer(recipes[recipe_id]).data
+            data['similarity'] = round(similarity, 4)
+            results.append(data)
+
+        return Response(results)
+
     @action(
         detail=True,
         methods=['post', 'delete'],
@@ -72,24 +215,13 @@ class RecipeViewSet(ModelViewSet):
         url_path='shopping_cart',
     )
     def shopping_cart(self, request, pk=None):
-        recipe = get_object_or_404(Recipe, pk=pk)
-        user = request.user
         if request.method == 'POST':
-            obj = ShoppingCart.objects.create(user=user, recipe=recipe)
-            obj.save()
-            serializer = RecipeInShortSerializer(
-                recipe,
-                context={'request': request}
+            return self.add_recipe(
+                request, pk, ShoppingCart, 'cart_count',
+                'Рецепт уже в списке покупок'
             )
 
-            return Response(serializer.data, status=status.HTTP_200_OK)
-        if request.method == 'DELETE':
-            obj = ShoppingCart.objects.filter(user=user, recipe=recipe)
-            obj.delete()
-
-            return Response(status=status.HTTP_204_NO_CONTENT)
-
-        return Response(status=status.HTTP_400_BAD_REQUEST)
+        return self.remove_recipe(request, pk, ShoppingCart, 'cart_count')
 
     @action(
         detail=True,
@@ -98,23 +230,129 @@ class RecipeViewSet(ModelViewSet):
         url_path='favorite',
     )
     def favorite(self, request, pk=None):
-        recipe = get_object_or_404(Recipe, pk=pk)
-        user = request.user
         if request.method == 'POST':
-            obj = Favorite.objects.create(user=user, recipe=recipe)
-            serializer = RecipeInShortSerializer(
-                recipe,
-                context={'request': request}
+            return self.add_recipe(
+                request, pk, Favorite, 'favorites_count',
+                'Рецепт уже в избранном'
+            )
+
+        return self.remove_recipe(request, pk, Favorite, 'favorites_count')
+
+    @action(
+        detail=False,
+        methods=['post'],
+        permission_classes=[IsAuthenticated],
+        url_path='shopping_cart/bulk',
+    )
+    def shopping_cart_bulk(self, request):
+        return self.add_recipes_bulk(request, ShoppingCart, 'cart_count')
+
+    @action(
+        detail=False,
+        methods=['post'],
+        permission_classes=[IsAuthenticated],
+        url_path='favorite/bulk',
+    )
+    def favorite_bulk(self, request):
+        return self.add_recipes_bulk(request, Favorite, 'favorites_count')
+
+    def add_recipes_bulk(self, request, model, counter):
+        """
+        Добавляет несколько рецептов: один запрос проверяет рецепты, один
+        находит уже добавленные, один bulk_create вставляет остальные.
+        Для каждого id возвращается статус created, exists или not_found.
+        """
+        serializer = RecipeIdsSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        ids = list(dict.fromkeys(serializer.validated_data['recipes']))
+
+        recipes = Recipe.objects.in_bulk(ids)
+        existing = set(
+            model.objects.filter(
+                user=request.user,
+                recipe_id__in=recipes
+            ).values_list('recipe_id', flat=True)
+        )
+        new_ids = [
+            recipe_id for recipe_id in ids
+            if recipe_id in recipes and recipe_id not in existing
+        ]
+
+        with transaction.atomic():
+            model.objects.bulk_create(
+                [
+                    model(user=request.user, recipe_id=recipe_id)
+                    for recipe_id in new_ids
+                ],
+                ignore_conflicts=True
+            )
+            if new_ids:
+                Recipe.objects.filter(pk__in=new_ids).change_counter(
+                    counter, 1
+                )
+
+        results = []
+        for recipe_id in ids:
+            if recipe_id not in recipes:
+                results.append({'id': recipe_id, 'status': 'not_found'})
+                continue
+            results.append({
+                'id': recipe_id,
+                'status': 'exists' if recipe_id in existing else 'created',
+                'recipe': RecipeInShortSerializer(
+                    recipes[recipe_id],
+                    context={'request': request}
+                ).data
+            })
+
+        return Response({'results': results}, status=status.HTTP_200_OK)
+
+    def add_recipe(self, request, pk, model, counter, error):
+        """
+        Добавляет рецепт в избранное или список покупок одним INSERT без
+        предварительного SELECT. Повторное добавление даёт 400, а
+        несуществующий рецепт определяется по внешнему ключу и даёт 404.
+        """
+        recipe_id = parse_pk(pk)
+        try:
+            with transaction.atomic():
+                created = model.objects.insert_ignore(
+                    user=request.user,
+                    recipe=recipe_id
+                )
+                if created:
+                    Recipe.objects.filter(pk=recipe_id).change_counter(
+                        counter, 1
+                    )
+        except IntegrityError:
+            raise NotFound()
+
+        if not created:
+            return Response(
+                {'errors': error},
+                status=status.HTTP_400_BAD_REQUEST
             )
 
-            return Response(serializer.data, status=status.HTTP_200_OK)
-        if request.method == 'DELETE':
-            obj = Favorite.objects.filter(user=user, recipe=recipe)
-            obj.delete()
+        serializer = RecipeInShortSerializer(
+            get_object_or_404(Recipe, pk=recipe_id),
+            context={'request': request}
+        )
 
-            return Response(status=status.HTTP_204_NO_CONTENT)
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
 
-        return Response(status=status.HTTP_400_BAD_REQUEST)
+    def remove_recipe(self, request, pk, model, counter):
+        recipe = get_object_or_404(Recipe, pk=pk)
+        with transaction.atomic():
+            deleted, _ = model.objects.filter(
+                user=request.user,
+                recipe=recipe
+            ).delete()
+            if deleted:
+                Recipe.objects.filter(pk=recipe.pk).change_counter(
+                    counter, -deleted
+                )
+
+        return Response(status=status.HTTP_204_NO_CONTENT)
 
     @action(
         detail=False,
@@ -123,35 +361,23 @@ class RecipeViewSet(ModelViewSet):
         url_path='download_shopping_cart',
     )
     def download_shopping_cart(self, request):
-        recipes = ShoppingCart.objects.filter(user=request.user)
-
-        shopping_cart = {}
-        for recipe in recipes:
-            ingredients = RecipeIngredient.objects.filter(recipe=recipe.recipe)
-            for ingredient in ingredients:
-                name = ingredient.ingredient.name
-                amount = int(ingredient.amount)
-                unit = ingredient.ingredient.measurement_unit
-
-                if name not in shopping_cart:
-                    shopping_cart[name] = {
-                        'measurement_unit': unit,
-                        'amount': amount
-                    }
-                else:
-                    shopping_cart[name]['amount'] += amount
-
-        file_content = ''
-        for ingredient_name in shopping_cart:
-            file_content += (
-                f'{ingredient_name} - '
-                f'{shopping_cart[ingredient_name]["amount"]} '
-                f'{shopping_cart[ingredient_name]["measurement_unit"]}\n'
+        file_type = request.query_params.get('type', 'txt')
+        if file_type not in SHOPPING_CART_FORMATS:
+            return Response(
+                {'errors': 'Неподдерживаемый формат файла'},
+                status=status.HTTP_400_BAD_REQUEST
             )
 
-        file = 'shopping_cart'
-        response = HttpResponse(file_content, content_type='text/plain')
-        response['Content-Disposition'] = f'attachment; filename={file}.txt'
+        render, content_type = SHOPPING_CART_FORMATS[file_type]
+        ingredients = get_shopping_cart_ingredients(request.user)
+
+        response = StreamingHttpResponse(
+            render(ingredients),
+            content_type=content_type
+        )
+        response['Content-Disposition'] = (
+            f'attachment; filename={SHOPPING_CART_FILENAME}.{file_type}'
+        )
 
         return response
 
@@ -170,9 +396,23 @@ class UserViewSet(djoser_views.UserViewSet):
         permission_classes=[IsAuthenticated]
     )
     def subscriptions(self, request):
-        user = request.user
-        queryset = User.objects.filter(subscribers__user=user)
+        limit = get_recipes_limit(request)
+        queryset = User.objects.filter(
+            subscribers__user=request.user
+        ).annotate(
+            recipes_count=Count('recipes', distinct=True),
+            is_subscribed=Value(True, output_field=BooleanField()),
+        ).order_by('pk')
         pages = self.paginate_queryset(queryset)
+
+        previews = {author.pk: [] for author in pages}
+        if limit and previews:
+            recipes = Recipe.objects.latest_by_author(list(previews), limit)
+            for recipe in recipes:
+                previews[recipe.author_id].append(recipe)
+        for author in pages:
+            author.recipes_preview = previews[author.pk]
+
         serializer = UserWithRecipesSerializer(
             pages,
             many=True,
@@ -189,20 +429,43 @@ class UserViewSet(djoser_views.UserViewSet):
     )
     def subscribe(self, request, pk=None):
         user = request.user
-        author = get_object_or_404(User, pk=pk)
         if request.method == 'POST':
-            obj = Subscription.objects.create(user=user, author=author)
-            obj.save()
+            author_id = parse_pk(pk)
+            if author_id == user.pk:
+                return Response(
+                    {'errors': 'Нельзя подписаться на самого себя'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            try:
+                with transaction.atomic():
+                    created = Subscription.objects.insert_ignore(
+                        user=user,
+                        author=author_id
+                    )
+                    if created:
+                        FeedEntry.objects.follow(user.pk, author_id)
+            except IntegrityError:
+                raise NotFound()
+            if not created:
+                return Response(
+                    {'errors': 'Вы уже подписаны на этого автора'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+
             serializer = UserWithRecipesSerializer(
-                author,
+                get_object_or_404(User, pk=author_id),
                 context={'request': request}
             )
 
-            return Response(serializer.data, status=status.HTTP_200_OK)
-        if request.method == 'DELETE':
-            obj = Subscription.objects.filter(user=user, author=author)
-            obj.delete()
+            return Response(serializer.data, status=status.HTTP_201_CREATED)
 
-            return Response(status=status.HTTP_204_NO_CONTENT)
-
-        return Response(status=status.HTTP_400_BAD_REQUEST)
+        author = get_object_or_404(User, pk=pk)
+        with transaction.atomic():
+            deleted, _ = Subscription.objects.filter(
+                user=user,
+                author=author
+            ).delete()
+            if deleted:
+                FeedEntry.objects.unfollow(user.pk, author.pk)
+
+        return Response(status=status.HTTP_204_NO_CONTENT)
@@ -3,14 +3,19 @@ ASGI config for foodgram project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
 
+Django 2.2 has no ASGI handler and no async views, so the WSGI application
+is wrapped with asgiref's WsgiToAsgi: views stay synchronous and run in a
+thread pool of the ASGI server.
+
 For more information on this file, see
-https://docs.djangoproject.com/en/3.2/howto/deployment/asgi/
+https://asgi.readthedocs.io/en/latest/
 """
 
 import os
 
-from django.core.asgi import get_asgi_application
+from asgiref.wsgi import WsgiToAsgi
+from django.core.wsgi import get_wsgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'foodgram.settings')
 
-application = get_asgi_application()
+application = WsgiToAsgi(get_wsgi_application())
@@ -41,8 +41,8 @@ INSTALLED_APPS = [
     'rest_framework.authtoken',
     'django_filters',
     'djoser',
-    'api',
-    'recipes',
+    'api.apps.ApiConfig',
+    'recipes.apps.RecipesConfig',
 ]
 
 MIDDLEWARE = [
@@ -91,6 +91,39 @@ DATABASES = {
     }
 }
 
+# Cache
+# Ответы справочников (теги, ингредиенты) кэшируются в API_CACHE_ALIAS.
+# Для нескольких воркеров укажите общий бэкенд, например Redis.
+
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv(
+            'CACHE_BACKEND',
+            'django.core.cache.backends.locmem.LocMemCache'
+        ),
+        'LOCATION': os.getenv('CACHE_LOCATION', 'foodgram'),
+    }
+}
+
+API_CACHE_ALIAS = 'default'
+API_CACHE_MAX_AGE = 60
+TOKEN_CACHE_TTL = 60
+
+# Лента подписок
+# Для пользователей, подписанных на FEED_PRECOMPUTE_MIN_SUBSCRIPTIONS и
+# более авторов, команда build_feeds хранит FEED_SIZE последних рецептов.
+
+FEED_PRECOMPUTE_MIN_SUBSCRIPTIONS = 1000
+FEED_SIZE = 500
+
+# Популярные рецепты
+# trending_score затухает командой update_trending, список лучших
+# TRENDING_SIZE рецептов кэшируется на TRENDING_CACHE_TTL секунд.
+
+TRENDING_HALF_LIFE_HOURS = 24
+TRENDING_SIZE = 100
+TRENDING_CACHE_TTL = 60
+
 # Password validation
 # https://docs.djangoproject.com/en/3.2/ref/settings/#auth-password-validators
 
@@ -149,7 +182,7 @@ DEFAULT_FROM_EMAIL = 'db.yamdb@example.com'
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication',
+        'api.authentication.CachedTokenAuthentication',
     ],
     'DEFAULT_PERMISSION_CLASSES': [
         'api.custom_permissions.IsReadOnly',
@@ -72,20 +72,28 @@ class RecipeAdmin(admin.ModelAdmin):
         FavoriteInline,
     )
 
+    def save_related(self, request, form, formsets, change):
+        """
+        Инлайны добавляют и удаляют строки избранного, корзины и
+        ингредиентов в обход API, поэтому счётчики рецепта пересчитываются.
+        """
+        super().save_related(request, form, formsets, change)
+        Recipe.objects.filter(pk=form.instance.pk).rebuild_counters()
+
     def get_ingredients_count(self, obj):
-        return obj.ingredients.count()
+        return obj.ingredients_count
 
     get_ingredients_count.short_description = 'Количество ингредиентов'
-    get_ingredients_count.admin_order_field = 'get_ingredients_count'
+    get_ingredients_count.admin_order_field = 'ingredients_count'
 
     def get_shopping_cart_count(self, obj):
-        return obj.shopping_cart.count()
+        return obj.cart_count
 
     get_shopping_cart_count.short_description = 'Количество в корзине'
-    get_shopping_cart_count.admin_order_field = 'get_shopping_cart_count'
+    get_shopping_cart_count.admin_order_field = 'cart_count'
 
     def get_favorites_count(self, obj):
-        return obj.favorite.count()
+        return obj.favorites_count
 
     get_favorites_count.short_description = 'Количество в избранном'
-    get_favorites_count.admin_order_field = 'get_favorites_count'
+    get_favorites_count.admin_order_field = 'favorites_count'
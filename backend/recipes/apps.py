@@ -1,5 +1,16 @@
 from django.apps import AppConfig
+from django.db import connections
+from django.db.models.signals import post_migrate
+
+
+def install_recipe_search(sender, using, **kwargs):
+    from .search import install_search
+
+    install_search(connections[using])
 
 
 class RecipesConfig(AppConfig):
     name = 'recipes'
+
+    def ready(self):
+        post_migrate.connect(install_recipe_search, sender=self)
@@ -0,0 +1,162 @@
+import hashlib
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from pathlib import PurePath
+
+from django.core.files.base import ContentFile
+from django.db import close_old_connections, transaction
+from PIL import Image, ImageOps
+
+from .models import Recipe
+
+MAX_IMAGE_SIZE = (1920, 1920)
+VARIANT_WIDTHS = (320, 640, 1280)
+VARIANT_FORMATS = {
+    'webp': ('WEBP', {'quality': 80, 'method': 4}),
+    'jpg': ('JPEG', {'quality': 80, 'optimize': True, 'progressive': True}),
+}
+VARIANTS_DIR = 'recipes/variants'
+EXIF_ORIENTATION = 0x0112
+SAVE_FORMATS = {
+    'JPEG': {'quality': 85, 'optimize': True, 'progressive': True},
+    'PNG': {'optimize': True},
+}
+
+logger = logging.getLogger(__name__)
+executor = ThreadPoolExecutor(
+    max_workers=2,
+    thread_name_prefix='recipe-images'
+)
+
+
+def normalize_image(recipe_id):
+    """
+    Уменьшает изображение рецепта до MAX_IMAGE_SIZE и перекодирует его,
+    убирая метаданные. GIF не трогает, чтобы не потерять анимацию.
+    """
+    recipe = Recipe.objects.only('image').get(pk=recipe_id)
+    old_name = recipe.image.name
+
+    with recipe.image.open('rb') as file:
+        image = Image.open(file)
+        image_format = image.format
+        if image_format not in SAVE_FORMATS:
+            return
+        if (image.width <= MAX_IMAGE_SIZE[0]
+                and image.height <= MAX_IMAGE_SIZE[1]):
+            return
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail(MAX_IMAGE_SIZE, Image.LANCZOS)
+
+    content = BytesIO()
+    image.save(content, image_format, **SAVE_FORMATS[image_format])
+    storage = recipe.image.storage
+    new_name = storage.save(
+        recipe.image.field.generate_filename(
+            recipe, PurePath(old_name).name
+        ),
+        ContentFile(content.getvalue())
+    )
+
+    # Рецепт мог получить новое изображение, пока шла обработка.
+    updated = Recipe.objects.filter(
+        pk=recipe_id,
+        image=old_name
+    ).update(image=new_name)
+    storage.delete(old_name if updated else new_name)
+
+
+def variant_name(digest, width, extension):
+    return f'{VARIANTS_DIR}/{digest}_{width}.{extension}'
+
+
+def variant_widths(image_width):
+    """
+    Ширины вариантов для изображения шириной image_width: большие
+    исходной заменяются ею, так как изображения не увеличиваются. Для
+    неизвестной ширины (0) возвращает VARIANT_WIDTHS.
+    """
+    if not image_width:
+        return VARIANT_WIDTHS
+
+    return tuple(sorted({
+        min(width, image_width) for width in VARIANT_WIDTHS
+    }))
+
+
+def get_image_width(content):
+    """Ширина изображения с учётом поворота из EXIF, без декодирования."""
+    image = Image.open(BytesIO(content))
+    width, height = image.size
+    if image.getexif().get(EXIF_ORIENTATION) in (5, 6, 7, 8):
+        return height
+    return width
+
+
+def render_variants(name):
+    """
+    Создаёт уменьшенные копии изображения name во всех VARIANT_FORMATS и
+    возвращает хеш содержимого, из которого строятся их имена, и ширину
+    исходного изображения. Копии с таким именем уже не пересоздаются.
+    В базу данных не обращается, поэтому подходит для выполнения
+    в отдельном процессе.
+    """
+    storage = Recipe._meta.get_field('image').storage
+    with storage.open(name, 'rb') as file:
+        content = file.read()
+    digest = hashlib.sha1(content).hexdigest()[:16]
+    width = get_image_width(content)
+
+    image = None
+    for variant_width in variant_widths(width):
+        resized = None
+        for extension, (image_format, options) in VARIANT_FORMATS.items():
+            variant = variant_name(digest, variant_width, extension)
+            if storage.exists(variant):
+                continue
+            if image is None:
+                image = ImageOps.exif_transpose(Image.open(BytesIO(content)))
+                image = image.convert('RGB')
+            if resized is None:
+                resized = image.copy()
+                resized.thumbnail(
+                    (variant_width, variant_width * 4),
+                    Image.LANCZOS
+                )
+            buffer = BytesIO()
+            resized.save(buffer, image_format, **options)
+            saved = storage.save(variant, ContentFile(buffer.getvalue()))
+            if saved != variant:
+                # Такую же копию уже сохранил параллельный процесс.
+                storage.delete(saved)
+
+    return digest, width
+
+
+def process_image(recipe_id):
+    """Нормализует изображение рецепта и создаёт его варианты."""
+    normalize_image(recipe_id)
+    name = Recipe.objects.values_list('image', flat=True).get(pk=recipe_id)
+    digest, width = render_variants(name)
+    Recipe.objects.filter(
+        pk=recipe_id,
+        image=name
+    ).update(image_hash=digest, image_width=width)
+
+
+def run_task(task, *args):
+    close_old_connections()
+    try:
+        task(*args)
+    except Exception:
+        logger.exception('Ошибка фоновой обработки изображения %s', args)
+    finally:
+        close_old_connections()
+
+
+def schedule_image_processing(recipe_id):
+    """Ставит обработку изображения в очередь после коммита транзакции."""
+    transaction.on_commit(
+        lambda: executor.submit(run_task, process_image, recipe_id)
+    )
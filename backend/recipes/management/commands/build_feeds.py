@@ -0,0 +1,57 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count
+
+from recipes.models import Feed, FeedEntry, Subscription
+
+
+class Command(BaseCommand):
+    """
+    Команда для пересборки лент подписок. Ленты хранятся только для
+    пользователей с большим числом подписок; остальные читают ленту
+    напрямую. Между запусками ленты пополняются при публикации рецептов
+    и изменении подписок, команда обрезает их до --size записей и
+    назначает ленты пользователям по числу подписок.
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--min-subscriptions',
+            type=int,
+            default=settings.FEED_PRECOMPUTE_MIN_SUBSCRIPTIONS,
+            help='Минимальное число подписок для хранимой ленты'
+        )
+        parser.add_argument(
+            '--size',
+            type=int,
+            default=settings.FEED_SIZE,
+            help='Количество рецептов в ленте'
+        )
+
+    def handle(self, *args, **options):
+        users = list(
+            Subscription.objects.order_by().values('user').annotate(
+                total=Count('pk')
+            ).filter(
+                total__gte=options['min_subscriptions']
+            ).values_list('user', flat=True)
+        )
+
+        Feed.objects.exclude(user__in=users).delete()
+        dropped, _ = FeedEntry.objects.exclude(user__in=users).delete()
+        if dropped:
+            self.stdout.write(f'Удалено записей лент: {dropped}')
+
+        for user_id in users:
+            with transaction.atomic():
+                added, removed = FeedEntry.objects.rebuild(
+                    user_id, options['size']
+                )
+            self.stdout.write(
+                f'Пользователь {user_id}: +{added} -{removed}'
+            )
+
+        self.stdout.write(
+            self.style.SUCCESS(f'Ленты собраны: {len(users)}')
+        )
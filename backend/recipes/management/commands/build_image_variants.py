@@ -0,0 +1,61 @@
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from recipes.images import render_variants
+from recipes.models import Recipe
+
+
+class Command(BaseCommand):
+    """Команда для создания уменьшенных копий изображений рецептов"""
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=os.cpu_count(),
+            help='Количество процессов для обработки изображений'
+        )
+        parser.add_argument(
+            '--all',
+            action='store_true',
+            help='Обработать все рецепты, а не только без копий'
+        )
+
+    def handle(self, *args, **options):
+        recipes = Recipe.objects.exclude(image='')
+        if not options['all']:
+            recipes = recipes.filter(image_hash='')
+        recipes = list(recipes.values_list('pk', 'image'))
+
+        self.stdout.write(self.style.WARNING(
+            f'Обработка изображений: {len(recipes)}'
+        ))
+        # Дочерние процессы не должны наследовать открытые соединения.
+        connections.close_all()
+
+        done = failed = 0
+        with ProcessPoolExecutor(max_workers=options['workers']) as pool:
+            futures = {
+                pool.submit(render_variants, name): (pk, name)
+                for pk, name in recipes
+            }
+            for future in as_completed(futures):
+                pk, name = futures[future]
+                try:
+                    digest, width = future.result()
+                except Exception as error:
+                    failed += 1
+                    self.stderr.write(f'{name}: {error}')
+                    continue
+                Recipe.objects.filter(
+                    pk=pk,
+                    image=name
+                ).update(image_hash=digest, image_width=width)
+                done += 1
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Готово: {done}, с ошибками: {failed}'
+        ))
@@ -1,18 +1,115 @@
+import csv
 import json
+import re
+import time
+from itertools import islice
+from pathlib import Path
 
-from django.core.management.base import BaseCommand
+from django.core.management.base import BaseCommand, CommandError
 
 from recipes.models import Ingredient
 
+DEFAULT_PATH = 'data/ingredients.json'
+READ_SIZE = 64 * 1024
+SEPARATORS = re.compile(r'[\s,]*')
+
+
+def read_json(file):
+    """Читает JSON-массив объектов по частям, не загружая файл целиком."""
+    decoder = json.JSONDecoder()
+    buffer = file.read(READ_SIZE).lstrip()
+    if not buffer.startswith('['):
+        raise CommandError('Ожидался JSON-массив')
+
+    position = 1
+    while True:
+        position = SEPARATORS.match(buffer, position).end()
+        if buffer.startswith(']', position):
+            return
+        try:
+            item, position = decoder.raw_decode(buffer, position)
+        except ValueError:
+            chunk = file.read(READ_SIZE)
+            if not chunk:
+                raise CommandError('Некорректный JSON')
+            buffer = buffer[position:] + chunk
+            position = 0
+            continue
+        yield item['name'], item['measurement_unit']
+
+
+def read_csv(file):
+    for row in csv.reader(file):
+        if row:
+            yield row[0], row[1]
+
+
+READERS = {
+    '.json': read_json,
+    '.csv': read_csv,
+}
+
 
 class Command(BaseCommand):
     """Команда для загрузки ингредиентов"""
 
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'path',
+            nargs='?',
+            default=DEFAULT_PATH,
+            help='Файл с ингредиентами в формате JSON или CSV'
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Количество строк в одном INSERT'
+        )
+
     def handle(self, *args, **options):
+        path = Path(options['path'])
+        batch_size = options['batch_size']
+        if path.suffix not in READERS:
+            raise CommandError(f'Неподдерживаемый формат файла: {path}')
+        if batch_size < 1:
+            raise CommandError('--batch-size должен быть больше нуля')
+
         self.stdout.write(self.style.WARNING('Загрузка ингредиентов'))
-        with open('data/ingredients.json', encoding='utf-8') as file:
-            ingredients = json.loads(file.read())
-            for ingredient in ingredients:
-                Ingredient.objects.get_or_create(**ingredient)
+        existing = set(
+            Ingredient.objects.values_list('name', 'measurement_unit')
+        )
+        started = time.monotonic()
+        read = created = 0
+
+        with open(path, encoding='utf-8', newline='') as file:
+            rows = READERS[path.suffix](file)
+            while True:
+                chunk = list(islice(rows, batch_size))
+                if not chunk:
+                    break
+                read += len(chunk)
+
+                batch = []
+                for name, measurement_unit in chunk:
+                    key = (name.strip(), measurement_unit.strip())
+                    if key in existing:
+                        continue
+                    existing.add(key)
+                    batch.append(Ingredient(
+                        name=key[0],
+                        measurement_unit=key[1]
+                    ))
+
+                Ingredient.objects.bulk_create(batch, ignore_conflicts=True)
+                created += len(batch)
+                elapsed = time.monotonic() - started
+                self.stdout.write(
+                    f'Прочитано {read}, добавлено {created} '
+                    f'({read / max(elapsed, 1e-6):.0f} строк/с)'
+                )
 
-        self.stdout.write(self.style.SUCCESS('Ингредиенты загружены'))
+        self.stdout.write(self.style.SUCCESS(
+            f'Ингредиенты загружены: {created} новых из {read} за '
+            f'{time.monotonic() - started:.2f} с'
+        ))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from recipes.models import Recipe
+
+
+class Command(BaseCommand):
+    """Команда для пересчёта счётчиков избранного, корзины и ингредиентов"""
+
+    def handle(self, *args, **options):
+        self.stdout.write(self.style.WARNING('Пересчёт счётчиков рецептов'))
+        updated = Recipe.objects.rebuild_counters()
+        self.stdout.write(
+            self.style.SUCCESS(f'Счётчики пересчитаны: {updated} рецептов')
+        )
@@ -0,0 +1,44 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from recipes.models import Recipe
+
+
+class Command(BaseCommand):
+    """
+    Команда для затухания популярности рецептов. Запускается периодически,
+    например из cron раз в --hours часов: за TRENDING_HALF_LIFE_HOURS
+    вклад каждого добавления в trending_score уменьшается вдвое.
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--hours',
+            type=float,
+            default=1,
+            help='Сколько часов прошло с предыдущего запуска'
+        )
+        parser.add_argument(
+            '--rebuild',
+            action='store_true',
+            help='Заново вычислить популярность по счётчикам'
+        )
+
+    def handle(self, *args, **options):
+        if options['rebuild']:
+            updated = Recipe.objects.rebuild_trending()
+            self.stdout.write(
+                self.style.SUCCESS(f'Популярность пересчитана: {updated}')
+            )
+            return
+
+        factor = 0.5 ** (options['hours'] / settings.TRENDING_HALF_LIFE_HOURS)
+        updated = Recipe.objects.filter(
+            trending_score__gt=0
+        ).decay_trending(factor)
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'Популярность уменьшена в {1 / factor:.3f} раза: '
+                f'{updated} рецептов'
+            )
+        )
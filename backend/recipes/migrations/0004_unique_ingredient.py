@@ -0,0 +1,73 @@
+# Generated by Django 2.2.28 on 2026-10-18 05:28
+
+from django.db import migrations, models
+from django.db.models.functions import Coalesce
+
+
+def count_by_recipe(model):
+    return Coalesce(
+        models.Subquery(
+            model.objects.filter(
+                recipe=models.OuterRef('pk')
+            ).order_by().values('recipe').annotate(
+                count=models.Count('pk')
+            ).values('count'),
+            output_field=models.PositiveIntegerField()
+        ),
+        0
+    )
+
+
+def merge_duplicate_ingredients(apps, schema_editor):
+    Ingredient = apps.get_model('recipes', 'Ingredient')
+    Recipe = apps.get_model('recipes', 'Recipe')
+    RecipeIngredient = apps.get_model('recipes', 'RecipeIngredient')
+    duplicates = Ingredient.objects.order_by().values(
+        'name', 'measurement_unit'
+    ).annotate(
+        keep=models.Min('id'),
+        total=models.Count('id')
+    ).filter(total__gt=1)
+
+    affected = set()
+    for group in duplicates:
+        extra = Ingredient.objects.filter(
+            name=group['name'],
+            measurement_unit=group['measurement_unit']
+        ).exclude(id=group['keep'])
+        merged = RecipeIngredient.objects.filter(
+            ingredient__in=extra,
+            recipe__in=RecipeIngredient.objects.filter(
+                ingredient_id=group['keep']
+            ).values('recipe')
+        )
+        affected.update(merged.values_list('recipe_id', flat=True))
+        merged.delete()
+        RecipeIngredient.objects.filter(
+            ingredient__in=extra
+        ).update(ingredient_id=group['keep'])
+        extra.delete()
+
+    # Migration 0003 already counted the rows deleted above.
+    if affected:
+        Recipe.objects.filter(id__in=affected).update(
+            ingredients_count=count_by_recipe(RecipeIngredient)
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0003_recipe_counters'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            merge_duplicate_ingredients,
+            migrations.RunPython.noop
+        ),
+        migrations.AddConstraint(
+            model_name='ingredient',
+            constraint=models.UniqueConstraint(fields=('name', 'measurement_unit'), name='unique_ingredient'),
+        ),
+    ]
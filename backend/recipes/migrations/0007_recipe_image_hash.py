@@ -0,0 +1,18 @@
+# Generated by Django 2.2.28 on 2026-10-18 05:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0006_feed_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='image_hash',
+            field=models.CharField(blank=True, editable=False, help_text='Хеш содержимого, по которому строятся имена вариантов', max_length=40, verbose_name='Хеш изображения'),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 2.2.28 on 2026-10-18 05:41
+
+import django.contrib.postgres.search
+from django.db import migrations
+
+from recipes.search import install_search, uninstall_search
+
+
+def create_search_index(apps, schema_editor):
+    install_search(schema_editor.connection)
+
+
+def drop_search_index(apps, schema_editor):
+    uninstall_search(schema_editor.connection)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0007_recipe_image_hash'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True, verbose_name='Поисковый вектор'),
+        ),
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 2.2.28 on 2026-10-18 05:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0010_recipe_trending_score'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='image_width',
+            field=models.PositiveIntegerField(default=0, editable=False, help_text='Ширина исходного изображения, до которой строятся варианты', verbose_name='Ширина изображения'),
+        ),
+    ]
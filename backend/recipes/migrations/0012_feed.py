@@ -0,0 +1,27 @@
+# Generated by Django 2.2.28 on 2026-10-18 05:57
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0011_update_proxy_permissions'),
+        ('recipes', '0011_recipe_image_width'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Feed',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='feed', serialize=False, to=settings.AUTH_USER_MODEL, verbose_name='Пользователь')),
+                ('since', models.DateTimeField(verbose_name='Начало ленты')),
+            ],
+            options={
+                'verbose_name': 'Лента',
+                'verbose_name_plural': 'Ленты',
+            },
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 2.2.28 on 2026-10-18 06:12
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0012_feed'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='recipetag',
+            name='recipetag_tag_recipe_idx',
+        ),
+    ]
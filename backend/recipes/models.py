@@ -1,11 +1,24 @@
 from django.contrib.auth import get_user_model
+from django.contrib.postgres.search import (SearchQuery, SearchRank,
+                                            SearchVectorField)
 from django.core.validators import (MaxValueValidator, MinValueValidator,
                                     RegexValidator)
-from django.db import models
+from django.db import connections, models, router
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import Coalesce, Greatest, RowNumber
+from django.utils import timezone
+
+from .search import FTS_TABLE, RECIPE_TABLE, SEARCH_CONFIG, fts_query
 
 User = get_user_model()
 
 
+# Вклад одного добавления в избранное или корзину в trending_score.
+TRENDING_WEIGHTS = {
+    'favorites_count': 1.0,
+    'cart_count': 0.5,
+}
+
 HEX_COLOR_VALIDATOR = RegexValidator(
     r'^#[a-fA-F0-9]{6}$',
     message='Введите корректный цвет в формате #FFFFFF'
@@ -60,11 +73,243 @@ class Ingredient(models.Model):
         verbose_name = 'Ингредиент'
         verbose_name_plural = 'Ингредиенты'
         ordering = ('name', 'measurement_unit')
+        constraints = [
+            models.UniqueConstraint(
+                fields=['name', 'measurement_unit'],
+                name='unique_ingredient'
+            )
+        ]
 
     def __str__(self):
         return self.name
 
 
+class InsertIgnoreQuerySet(models.QuerySet):
+    """Выборки для таблиц связей с уникальными парами."""
+
+    def insert_ignore(self, **values):
+        """
+        Одним запросом вставляет строку, пропуская её при нарушении
+        уникальности (ON CONFLICT DO NOTHING / INSERT OR IGNORE).
+        Возвращает количество вставленных строк: 1 или 0. Ошибка внешнего
+        ключа по-прежнему приводит к IntegrityError.
+        """
+        connection = connections[router.db_for_write(self.model)]
+        ops = connection.ops
+        fields = [self.model._meta.get_field(name) for name in values]
+        params = [
+            value.pk if isinstance(value, models.Model) else value
+            for value in values.values()
+        ]
+        sql = '{} {} ({}) VALUES ({}){}'.format(
+            ops.insert_statement(ignore_conflicts=True),
+            ops.quote_name(self.model._meta.db_table),
+            ', '.join(ops.quote_name(field.column) for field in fields),
+            ', '.join(['%s'] * len(fields)),
+            ops.ignore_conflicts_suffix_sql(ignore_conflicts=True),
+        )
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            return cursor.rowcount
+
+
+def count_by_recipe(model):
+    """Подзапрос с количеством строк model для каждого рецепта."""
+    return Coalesce(
+        models.Subquery(
+            model.objects.filter(
+                recipe=models.OuterRef('pk')
+            ).order_by().values('recipe').annotate(
+                count=models.Count('pk')
+            ).values('count'),
+            output_field=models.PositiveIntegerField()
+        ),
+        0
+    )
+
+
+def recipe_prefetches():
+    """Подгрузка тегов и ингредиентов, которые выводит API рецепта."""
+    return (
+        'tags',
+        models.Prefetch(
+            'recipeingredient_set',
+            queryset=RecipeIngredient.objects.select_related('ingredient')
+        ),
+    )
+
+
+class RecipeQuerySet(models.QuerySet):
+    """Выборки рецептов для API."""
+
+    def with_related(self):
+        """Подгружает теги и ингредиенты пакетно, а не по рецепту."""
+        return self.prefetch_related(*recipe_prefetches())
+
+    def change_counter(self, field, delta):
+        """
+        Атомарно изменяет счётчик рецептов без чтения строк. Для счётчиков
+        избранного и корзины тем же UPDATE меняется и trending_score.
+        """
+        values = {field: models.F(field) + delta}
+        weight = TRENDING_WEIGHTS.get(field)
+        if weight:
+            values['trending_score'] = Greatest(
+                models.F('trending_score') + weight * delta,
+                0.0
+            )
+        return self.update(**values)
+
+    def decay_trending(self, factor):
+        """Умножает trending_score всех рецептов на factor одним UPDATE."""
+        return self.update(trending_score=models.F('trending_score') * factor)
+
+    def rebuild_trending(self):
+        """Заново вычисляет trending_score по текущим счётчикам."""
+        return self.update(trending_score=sum(
+            models.F(field) * weight
+            for field, weight in TRENDING_WEIGHTS.items()
+        ))
+
+    def rebuild_counters(self):
+        """
+        Пересчитывает счётчики по связанным таблицам одним UPDATE.
+        trending_score сдвигается на взвешенную разницу между новыми и
+        прежними счётчиками, поэтому накопленное затухание сохраняется.
+        """
+        models_by_field = {
+            'favorites_count': Favorite,
+            'cart_count': ShoppingCart,
+        }
+        return self.update(
+            favorites_count=count_by_recipe(Favorite),
+            cart_count=count_by_recipe(ShoppingCart),
+            ingredients_count=count_by_recipe(RecipeIngredient),
+            trending_score=Greatest(
+                models.F('trending_score') + sum(
+                    (count_by_recipe(models_by_field[field])
+                     - models.F(field)) * weight
+                    for field, weight in TRENDING_WEIGHTS.items()
+                ),
+                0.0
+            ),
+        )
+
+    def latest_by_author(self, author_ids, limit):
+        """
+        Последние limit рецептов каждого автора одним запросом с
+        ROW_NUMBER() OVER (PARTITION BY author_id).
+        """
+        ranked = self.filter(author__in=author_ids).annotate(
+            row_number=models.Window(
+                expression=RowNumber(),
+                partition_by=[models.F('author')],
+                order_by=[models.F('pub_date').desc(), models.F('id').desc()]
+            )
+        ).order_by().values(
+            'id', 'name', 'image', 'image_hash', 'image_width',
+            'cooking_time', 'author_id', 'row_number'
+        )
+        sql, params = ranked.query.sql_with_params()
+        return self.raw(
+            f'SELECT * FROM ({sql}) ranked '
+            f'WHERE row_number <= %s '
+            f'ORDER BY author_id, row_number',
+            params + (limit,)
+        )
+
+    def search(self, text):
+        """
+        Полнотекстовый поиск по названию и описанию, более релевантные
+        рецепты идут первыми. PostgreSQL ищет по search_vector, SQLite по
+        таблице FTS5, остальные базы по подстроке без ранжирования.
+        """
+        vendor = connections[self.db].vendor
+        if vendor == 'postgresql':
+            query = SearchQuery(text, config=SEARCH_CONFIG)
+            return self.filter(search_vector=query).annotate(
+                search_rank=SearchRank(models.F('search_vector'), query)
+            ).order_by('-search_rank', '-pub_date', '-id')
+
+        if vendor == 'sqlite':
+            query = fts_query(text)
+            if not query:
+                return self.none()
+
+            return self.extra(
+                where=[
+                    f'{RECIPE_TABLE}.id IN (SELECT rowid FROM {FTS_TABLE} '
+                    f'WHERE {FTS_TABLE} MATCH %s)'
+                ],
+                params=[query]
+            ).annotate(search_rank=RawSQL(
+                f'SELECT -bm25({FTS_TABLE}, 10.0, 1.0) FROM {FTS_TABLE} '
+                f'WHERE {FTS_TABLE} MATCH %s '
+                f'AND rowid = {RECIPE_TABLE}.id',
+                (query,)
+            )).order_by('-search_rank', '-pub_date', '-id')
+
+        return self.filter(
+            models.Q(name__icontains=text) | models.Q(text__icontains=text)
+        )
+
+    def feed(self, user):
+        """
+        Рецепты авторов, на которых подписан user, одним запросом
+        author IN (подписки) по индексу (author, pub_date).
+        """
+        return self.filter(
+            author__in=Subscription.objects.filter(user=user).values('author')
+        )
+
+    def with_user_flags(self, user):
+        """
+        Добавляет автора и флаги is_favorited, is_in_shopping_cart и
+        author.is_subscribed, вычисленные для пользователя одним запросом.
+        """
+        if not user or user.is_anonymous:
+            false = models.Value(False, output_field=models.BooleanField())
+            return self.select_related('author').annotate(
+                is_favorited=false,
+                is_in_shopping_cart=false,
+            )
+
+        authors = User.objects.annotate(
+            is_subscribed=models.Exists(
+                Subscription.objects.filter(
+                    user=user,
+                    author=models.OuterRef('pk')
+                )
+            )
+        )
+        return self.prefetch_related(
+            models.Prefetch('author', queryset=authors)
+        ).annotate(
+            is_favorited=models.Exists(
+                Favorite.objects.filter(
+                    user=user,
+                    recipe=models.OuterRef('pk')
+                )
+            ),
+            is_in_shopping_cart=models.Exists(
+                ShoppingCart.objects.filter(
+                    user=user,
+                    recipe=models.OuterRef('pk')
+                )
+            ),
+        )
+
+
+class RecipeManager(models.Manager.from_queryset(RecipeQuerySet)):
+    """
+    Менеджер рецептов. search_vector нужен только базе для поиска,
+    поэтому по умолчанию он не читается ни одним запросом к рецептам.
+    """
+
+    def get_queryset(self):
+        return super().get_queryset().defer('search_vector')
+
+
 class Recipe(models.Model):
     """Модель рецепта"""
     name = models.CharField(
@@ -96,6 +341,19 @@ class Recipe(models.Model):
         help_text='Загрузите изображение',
         upload_to='recipes/',
     )
+    image_hash = models.CharField(
+        verbose_name='Хеш изображения',
+        help_text='Хеш содержимого, по которому строятся имена вариантов',
+        max_length=40,
+        blank=True,
+        editable=False,
+    )
+    image_width = models.PositiveIntegerField(
+        verbose_name='Ширина изображения',
+        help_text='Ширина исходного изображения, до которой строятся варианты',
+        default=0,
+        editable=False,
+    )
     tags = models.ManyToManyField(
         Tag,
         related_name='recipes',
@@ -115,11 +373,61 @@ class Recipe(models.Model):
         help_text='Дата публикации рецепта',
         auto_now_add=True,
     )
+    favorites_count = models.PositiveIntegerField(
+        verbose_name='Количество в избранном',
+        default=0,
+        editable=False,
+    )
+    cart_count = models.PositiveIntegerField(
+        verbose_name='Количество в корзине',
+        default=0,
+        editable=False,
+    )
+    ingredients_count = models.PositiveIntegerField(
+        verbose_name='Количество ингредиентов',
+        default=0,
+        editable=False,
+    )
+    trending_score = models.FloatField(
+        verbose_name='Популярность',
+        help_text='Взвешенное число добавлений, затухающее со временем',
+        default=0,
+        editable=False,
+    )
+    search_vector = SearchVectorField(
+        verbose_name='Поисковый вектор',
+        null=True,
+        editable=False,
+    )
+
+    objects = RecipeManager()
 
     class Meta:
         verbose_name = 'Рецепт'
         verbose_name_plural = 'Рецепты'
         ordering = ('-pub_date',)
+        indexes = [
+            models.Index(
+                fields=['-pub_date', '-id'],
+                name='recipe_pub_date_id_idx'
+            ),
+            models.Index(
+                fields=['author', '-pub_date'],
+                name='recipe_author_pub_date_idx'
+            ),
+            models.Index(
+                fields=['-favorites_count'],
+                name='recipe_favorites_count_idx'
+            ),
+            models.Index(
+                fields=['-cart_count'],
+                name='recipe_cart_count_idx'
+            ),
+            models.Index(
+                fields=['-trending_score', '-id'],
+                name='recipe_trending_score_idx'
+            ),
+        ]
 
     def __str__(self):
         return self.name
@@ -202,6 +510,8 @@ class Favorite(models.Model):
         help_text='Рецепт, который добавляется в избранное'
     )
 
+    objects = InsertIgnoreQuerySet.as_manager()
+
     class Meta:
         verbose_name = 'Избранное'
         verbose_name_plural = 'Избранное'
@@ -234,6 +544,8 @@ class ShoppingCart(models.Model):
         help_text='Рецепт, который добавляется в список покупок'
     )
 
+    objects = InsertIgnoreQuerySet.as_manager()
+
     class Meta:
         verbose_name = 'Покупка'
         verbose_name_plural = 'Покупки'
@@ -266,6 +578,8 @@ class Subscription(models.Model):
         help_text='Автор, на которого подписываются'
     )
 
+    objects = InsertIgnoreQuerySet.as_manager()
+
     class Meta:
         verbose_name = 'Подписка'
         verbose_name_plural = 'Подписки'
@@ -283,3 +597,151 @@ class Subscription(models.Model):
 
     def __str__(self):
         return f'{self.user} {self.author}'
+
+
+class FeedEntryQuerySet(models.QuerySet):
+    """Выборки заранее собранных лент."""
+
+    def rebuild(self, user_id, size):
+        """
+        Приводит ленту пользователя к size последним рецептам его авторов:
+        удаляет лишние записи, добавляет недостающие и запоминает в Feed
+        дату самого старого рецепта ленты.
+        """
+        recipes = dict(
+            Recipe.objects.filter(
+                author__in=Subscription.objects.filter(
+                    user_id=user_id
+                ).values('author')
+            ).order_by('-pub_date', '-id').values_list(
+                'id', 'pub_date'
+            )[:size]
+        )
+        entries = self.filter(user_id=user_id)
+        current = set(entries.values_list('recipe_id', flat=True))
+
+        removed, _ = entries.exclude(
+            recipe_id__in=list(recipes)
+        ).delete()
+        added = self.bulk_create(
+            [
+                FeedEntry(user_id=user_id, recipe_id=pk, pub_date=pub_date)
+                for pk, pub_date in recipes.items()
+                if pk not in current
+            ],
+            ignore_conflicts=True
+        )
+        Feed.objects.update_or_create(
+            user_id=user_id,
+            defaults={'since': min(recipes.values(), default=timezone.now())}
+        )
+        return len(added), removed
+
+    def add_recipe(self, recipe):
+        """Добавляет новый рецепт в собранные ленты подписчиков автора."""
+        users = Subscription.objects.filter(
+            author_id=recipe.author_id,
+            user__feed__isnull=False
+        ).values_list('user_id', flat=True)
+        return self.bulk_create(
+            [
+                FeedEntry(
+                    user_id=user_id,
+                    recipe=recipe,
+                    pub_date=recipe.pub_date
+                )
+                for user_id in users
+            ],
+            ignore_conflicts=True
+        )
+
+    def follow(self, user_id, author_id):
+        """Добавляет в собранную ленту рецепты нового автора."""
+        feed = Feed.objects.filter(user_id=user_id).first()
+        if feed is None:
+            return []
+
+        recipes = Recipe.objects.filter(
+            author_id=author_id,
+            pub_date__gte=feed.since
+        ).values_list('id', 'pub_date')
+        return self.bulk_create(
+            [
+                FeedEntry(user_id=user_id, recipe_id=pk, pub_date=pub_date)
+                for pk, pub_date in recipes
+            ],
+            ignore_conflicts=True
+        )
+
+    def unfollow(self, user_id, author_id):
+        """Убирает из собранной ленты рецепты автора."""
+        return self.filter(
+            user_id=user_id,
+            recipe__author_id=author_id
+        ).delete()
+
+
+class Feed(models.Model):
+    """
+    Заранее собранная лента подписок. Записи FeedEntry содержат все
+    рецепты авторов пользователя начиная с since, более старые рецепты
+    выбираются обычным запросом.
+    """
+    user = models.OneToOneField(
+        User,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='feed',
+        verbose_name='Пользователь',
+    )
+    since = models.DateTimeField(
+        verbose_name='Начало ленты',
+    )
+
+    class Meta:
+        verbose_name = 'Лента'
+        verbose_name_plural = 'Ленты'
+
+    def __str__(self):
+        return f'{self.user}'
+
+
+class FeedEntry(models.Model):
+    """Запись заранее собранной ленты подписок"""
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='feed_entries',
+        verbose_name='Пользователь',
+    )
+    recipe = models.ForeignKey(
+        Recipe,
+        on_delete=models.CASCADE,
+        related_name='feed_entries',
+        verbose_name='Рецепт',
+    )
+    pub_date = models.DateTimeField(
+        verbose_name='Дата публикации',
+    )
+
+    objects = FeedEntryQuerySet.as_manager()
+
+    class Meta:
+        verbose_name = 'Запись ленты'
+        verbose_name_plural = 'Записи ленты'
+        ordering = ('user', '-pub_date')
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'recipe'],
+                name='unique_feed_entry'
+            )
+        ]
+        indexes = [
+            models.Index(
+                fields=['user', '-pub_date'],
+                name='feed_entry_user_pub_date_idx'
+            ),
+        ]
+
+    def __str__(self):
+        return f'{self.user} {self.recipe}'
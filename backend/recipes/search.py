@@ -0,0 +1,139 @@
+"""
+Полнотекстовый поиск по названию и описанию рецепта.
+
+В PostgreSQL колонку search_vector заполняет триггер (русская морфология,
+название весит больше описания), поиск идёт по GIN-индексу. В SQLite
+вместо неё используется внешняя таблица FTS5 с триггерами синхронизации.
+Таблица рецептов в SQLite пересоздаётся при изменении схемы вместе с
+триггерами, поэтому install_search вызывается и после каждой миграции.
+"""
+import re
+
+SEARCH_CONFIG = 'russian'
+RECIPE_TABLE = 'recipes_recipe'
+SEARCH_INDEX = 'recipe_search_vector_idx'
+FTS_TABLE = 'recipes_recipe_fts'
+
+POSTGRES_INSTALL = (
+    f"""
+    CREATE OR REPLACE FUNCTION {RECIPE_TABLE}_search_vector_update()
+    RETURNS trigger AS $$
+    BEGIN
+        NEW.search_vector :=
+            setweight(to_tsvector('pg_catalog.{SEARCH_CONFIG}',
+                                  coalesce(NEW.name, '')), 'A') ||
+            setweight(to_tsvector('pg_catalog.{SEARCH_CONFIG}',
+                                  coalesce(NEW.text, '')), 'B');
+        RETURN NEW;
+    END
+    $$ LANGUAGE plpgsql
+    """,
+    f'DROP TRIGGER IF EXISTS {RECIPE_TABLE}_search_vector '
+    f'ON {RECIPE_TABLE}',
+    f"""
+    CREATE TRIGGER {RECIPE_TABLE}_search_vector
+    BEFORE INSERT OR UPDATE OF name, text ON {RECIPE_TABLE}
+    FOR EACH ROW EXECUTE PROCEDURE {RECIPE_TABLE}_search_vector_update()
+    """,
+    f'CREATE INDEX IF NOT EXISTS {SEARCH_INDEX} '
+    f'ON {RECIPE_TABLE} USING gin (search_vector)',
+    f'UPDATE {RECIPE_TABLE} SET name = name WHERE search_vector IS NULL',
+)
+
+POSTGRES_UNINSTALL = (
+    f'DROP INDEX IF EXISTS {SEARCH_INDEX}',
+    f'DROP TRIGGER IF EXISTS {RECIPE_TABLE}_search_vector '
+    f'ON {RECIPE_TABLE}',
+    f'DROP FUNCTION IF EXISTS {RECIPE_TABLE}_search_vector_update()',
+)
+
+SQLITE_TRIGGERS = {
+    f'{FTS_TABLE}_insert': f"""
+        CREATE TRIGGER {FTS_TABLE}_insert AFTER INSERT ON {RECIPE_TABLE}
+        BEGIN
+            INSERT INTO {FTS_TABLE}(rowid, name, text)
+            VALUES (new.id, new.name, new.text);
+        END
+    """,
+    f'{FTS_TABLE}_delete': f"""
+        CREATE TRIGGER {FTS_TABLE}_delete AFTER DELETE ON {RECIPE_TABLE}
+        BEGIN
+            INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, name, text)
+            VALUES ('delete', old.id, old.name, old.text);
+        END
+    """,
+    f'{FTS_TABLE}_update': f"""
+        CREATE TRIGGER {FTS_TABLE}_update
+        AFTER UPDATE OF name, text ON {RECIPE_TABLE}
+        BEGIN
+            INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, name, text)
+            VALUES ('delete', old.id, old.name, old.text);
+            INSERT INTO {FTS_TABLE}(rowid, name, text)
+            VALUES (new.id, new.name, new.text);
+        END
+    """,
+}
+
+SQLITE_CREATE_TABLE = (
+    f'CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5('
+    f"name, text, content='{RECIPE_TABLE}', content_rowid='id', "
+    f"tokenize='unicode61 remove_diacritics 2')"
+)
+
+WORD_RE = re.compile(r'\w+')
+
+
+def has_search_vector(connection, cursor):
+    if RECIPE_TABLE not in connection.introspection.table_names(cursor):
+        return False
+
+    columns = connection.introspection.get_table_description(
+        cursor, RECIPE_TABLE
+    )
+    return any(column.name == 'search_vector' for column in columns)
+
+
+def install_search(connection):
+    """Создаёт индекс и триггеры поиска; повторный вызов безопасен."""
+    with connection.cursor() as cursor:
+        if not has_search_vector(connection, cursor):
+            return
+
+        if connection.vendor == 'postgresql':
+            for sql in POSTGRES_INSTALL:
+                cursor.execute(sql)
+        elif connection.vendor == 'sqlite':
+            cursor.execute(SQLITE_CREATE_TABLE)
+            cursor.execute(
+                "SELECT name FROM sqlite_master WHERE type = 'trigger' "
+                "AND tbl_name = %s",
+                [RECIPE_TABLE]
+            )
+            existing = {row[0] for row in cursor.fetchall()}
+            missing = SQLITE_TRIGGERS.keys() - existing
+            for name in missing:
+                cursor.execute(SQLITE_TRIGGERS[name])
+            if missing:
+                cursor.execute(
+                    f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) "
+                    f"VALUES ('rebuild')"
+                )
+
+
+def uninstall_search(connection):
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            for sql in POSTGRES_UNINSTALL:
+                cursor.execute(sql)
+        elif connection.vendor == 'sqlite':
+            for name in SQLITE_TRIGGERS:
+                cursor.execute(f'DROP TRIGGER IF EXISTS {name}')
+            cursor.execute(f'DROP TABLE IF EXISTS {FTS_TABLE}')
+
+
+def fts_query(text):
+    """
+    Запрос FTS5 из пользовательского ввода: каждое слово ищется как
+    префикс, что отчасти заменяет отсутствующий в FTS5 русский стеммер.
+    """
+    return ' '.join(f'"{word}"*' for word in WORD_RE.findall(text))
@@ -0,0 +1,78 @@
+from django.contrib.auth import get_user_model
+from django.test import TestCase
+
+from .models import Favorite, Ingredient, Recipe, ShoppingCart
+
+User = get_user_model()
+
+INLINE_PREFIXES = (
+    'recipetag_set',
+    'recipeingredient_set',
+    'shopping_cart',
+    'favorite',
+)
+
+
+class RecipeAdminTest(TestCase):
+    """Правка рецепта в админке пересчитывает его счётчики."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_superuser(
+            username='admin',
+            email='admin@example.com',
+            password='password'
+        )
+        cls.ingredient = Ingredient.objects.create(name='Соль',
+                                                   measurement_unit='г')
+        cls.recipe = Recipe.objects.create(
+            author=cls.admin,
+            name='Рецепт',
+            text='Описание',
+            cooking_time=10,
+            image='recipes/image.jpg',
+            favorites_count=1,
+            trending_score=2.0,
+        )
+        cls.favorite = Favorite.objects.create(user=cls.admin,
+                                               recipe=cls.recipe)
+
+    def test_inlines_update_counters(self):
+        data = {
+            'name': self.recipe.name,
+            'text': self.recipe.text,
+            'cooking_time': self.recipe.cooking_time,
+            'author': self.admin.pk,
+        }
+        for prefix in INLINE_PREFIXES:
+            data[f'{prefix}-TOTAL_FORMS'] = 0
+            data[f'{prefix}-INITIAL_FORMS'] = 0
+        data.update({
+            'favorite-TOTAL_FORMS': 1,
+            'favorite-INITIAL_FORMS': 1,
+            'favorite-0-id': self.favorite.pk,
+            'favorite-0-recipe': self.recipe.pk,
+            'favorite-0-user': self.admin.pk,
+            'favorite-0-DELETE': 'on',
+            'shopping_cart-TOTAL_FORMS': 1,
+            'shopping_cart-0-user': self.admin.pk,
+            'recipeingredient_set-TOTAL_FORMS': 1,
+            'recipeingredient_set-0-ingredient': self.ingredient.pk,
+            'recipeingredient_set-0-amount': 5,
+        })
+
+        self.client.force_login(self.admin)
+        response = self.client.post(
+            f'/admin/recipes/recipe/{self.recipe.pk}/change/', data
+        )
+        self.assertEqual(response.status_code, 302)
+
+        self.recipe.refresh_from_db()
+        self.assertFalse(Favorite.objects.filter(recipe=self.recipe).exists())
+        self.assertTrue(
+            ShoppingCart.objects.filter(recipe=self.recipe).exists()
+        )
+        self.assertEqual(self.recipe.favorites_count, 0)
+        self.assertEqual(self.recipe.cart_count, 1)
+        self.assertEqual(self.recipe.ingredients_count, 1)
+        self.assertAlmostEqual(self.recipe.trending_score, 1.5)